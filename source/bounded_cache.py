@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+from utils import get_configuration
+
+caches = list()  # every BoundedCache, for the statistics logging
+
+
+class BoundedCache:
+    """
+    a dict like cache which evicts its least recently used entries beyond a maximal number of entries, and - if it
+    has an entry size function (e.g. the number of states and arcs of a transducer) - beyond a maximal total size of
+    its entries, so a few huge entries can not take unbounded memory.
+    the limits are read from the configuration on every insertion (caches are created before the configurations are
+    loaded).
+    hits and misses are counted by get(); `in` and [] do not count.
+    """
+    def __init__(self, name, max_size_configuration_key, max_total_size_configuration_key=None, get_entry_size=None):
+        self.name = name
+        self.max_size_configuration_key = max_size_configuration_key
+        self.max_total_size_configuration_key = max_total_size_configuration_key
+        self.get_entry_size = get_entry_size
+        self.entries = OrderedDict()
+        self.entry_sizes = dict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        caches.append(self)
+
+    def get_max_size(self):
+        return get_configuration(self.max_size_configuration_key)
+
+    def get_max_total_size(self):
+        if self.max_total_size_configuration_key is None:
+            return float("inf")
+        return get_configuration(self.max_total_size_configuration_key)
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def __getitem__(self, key):
+        return self.entries[key]
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            self.total_size -= self.entry_sizes[key]
+        entry_size = self.get_entry_size(value) if self.get_entry_size else 1
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.entry_sizes[key] = entry_size
+        self.total_size += entry_size
+        max_size = self.get_max_size()
+        max_total_size = self.get_max_total_size()
+        while len(self.entries) > max_size or self.total_size > max_total_size:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.total_size -= self.entry_sizes.pop(evicted_key)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.entry_sizes.clear()
+        self.total_size = 0
+
+    def get_statistics_line(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0
+        size_line = "{:,} of {:,} entries".format(len(self), self.get_max_size())
+        if self.max_total_size_configuration_key is not None:
+            size_line += " (total size {:,} of {:,})".format(self.total_size, self.get_max_total_size())
+        return "{}: {}, {:,} hits ({:.1%}), {:,} misses, {:,} evictions".format(
+            self.name, size_line, self.hits, hit_rate, self.misses, self.evictions)
+
+
+def get_caches_statistics_lines():
+    return [cache.get_statistics_line() for cache in caches]
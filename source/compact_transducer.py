@@ -0,0 +1,452 @@
+import functools
+import logging
+from array import array
+from collections import deque
+from copy import copy
+
+from segment import Segment, NULL_SEGMENT, JOKER_SEGMENT
+from transducer import Transducer, State, Arc, CostVector
+
+logger = logging.getLogger(__name__)
+
+NO_SYMBOL = -1
+
+
+class SymbolTable:
+    """Interns arc labels (segments and output sets) as dense ints.
+
+    A table is shared by a family of compact transducers - those that are intersected with each other, such as the
+    constraint transducers of a constraint set - so that their symbol ids can be intersected directly. The table
+    lives as long as the transducers of its family.
+    """
+    def __init__(self):
+        self.symbols = list()
+        self.symbol_ids = dict()
+        self.intersection_ids = dict()
+        self.expansion_by_id = dict()
+        self.null_id = self.get_symbol_id(NULL_SEGMENT)
+        self.joker_id = self.get_symbol_id(JOKER_SEGMENT)
+
+    @staticmethod
+    def _get_key(symbol):
+        if isinstance(symbol, (set, frozenset)):
+            return frozenset(symbol)
+        return symbol.get_symbol()
+
+    def get_symbol_id(self, symbol):
+        key = self._get_key(symbol)
+        symbol_id = self.symbol_ids.get(key)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(key if isinstance(key, frozenset) else symbol)
+            self.symbol_ids[key] = symbol_id
+        return symbol_id
+
+    def get_symbol(self, symbol_id):
+        symbol = self.symbols[symbol_id]
+        if isinstance(symbol, frozenset):
+            return set(symbol)
+        return symbol
+
+    def intersect(self, symbol_id1, symbol_id2):
+        """Same unification as Segment.intersect, memoized by ids. returns NO_SYMBOL on failure"""
+        key = (symbol_id1, symbol_id2)
+        intersection_id = self.intersection_ids.get(key)
+        if intersection_id is None:
+            unified = Segment.intersect(self.get_symbol(symbol_id1), self.get_symbol(symbol_id2))
+            intersection_id = NO_SYMBOL if unified is None else self.get_symbol_id(unified)
+            self.intersection_ids[key] = intersection_id
+        return intersection_id
+
+    def get_output_strings(self, symbol_id, alphabet_symbols):
+        """The strings an output label contributes to a range, see Transducer.get_range"""
+        if symbol_id == self.joker_id:
+            return alphabet_symbols
+        strings = self.expansion_by_id.get(symbol_id)
+        if strings is None:
+            symbol = self.symbols[symbol_id]
+            if isinstance(symbol, frozenset):
+                strings = list(symbol)
+            elif symbol_id == self.null_id:
+                strings = ['']
+            else:
+                strings = [symbol.get_symbol()]
+            self.expansion_by_id[symbol_id] = strings
+        return strings
+
+
+class CompactTransducer:
+    """
+    Array backed counterpart of Transducer.
+    states are dense ints and arcs are kept in parallel arrays sorted by origin state, so the arcs of
+    state s are at [state_offsets[s], state_offsets[s+1]) (CSR layout). equal cost vectors are stored once in
+    cost_pool and arcs point to them by offset. the arc labels are ids in the symbol_table of the transducer's family.
+    """
+    __slots__ = ["name", "alphabet", "length_of_cost_vectors", "number_of_states", "initial_state", "final_states",
+                 "state_offsets", "arc_inputs", "arc_outputs", "arc_terminals", "arc_cost_offsets", "cost_pool",
+                 "state_indices", "state_labels", "state_pairs", "operands", "symbol_table"]
+
+    def __init__(self, alphabet, name=None, length_of_cost_vectors=1, symbol_table=None):
+        self.name = name
+        self.alphabet = alphabet
+        self.length_of_cost_vectors = length_of_cost_vectors
+        self.number_of_states = 0
+        self.initial_state = 0
+        self.final_states = set()
+        self.state_offsets = array('l', [0])
+        self.arc_inputs = array('l')
+        self.arc_outputs = array('l')
+        self.arc_terminals = array('l')
+        self.arc_cost_offsets = array('l')
+        self.cost_pool = array('q')
+        self.state_indices = array('l')
+        self.state_labels = list()  # explicit labels, used when the transducer was converted from a Transducer
+        self.state_pairs = None     # (left, right) state ids, used when the transducer is an intersection product
+        self.operands = None
+        self.symbol_table = symbol_table if symbol_table is not None else SymbolTable()
+
+    @classmethod
+    def from_transducer(cls, transducer, symbol_table=None):
+        """the compact form of the transducer, in the family of symbol_table (a new family if it is None)"""
+        compact = cls(transducer.get_alphabet(), transducer.name, transducer.get_length_of_cost_vectors(),
+                      symbol_table)
+        symbol_table = compact.symbol_table
+        states = list(transducer.states)
+        for state in [transducer.initial_state] + transducer.final_states:
+            if state not in states:
+                states.append(state)
+
+        state_ids = {state: i for i, state in enumerate(states)}
+        compact.number_of_states = len(states)
+        compact.initial_state = state_ids[transducer.initial_state]
+        compact.final_states = {state_ids[state] for state in transducer.final_states}
+        compact.state_labels = [state.label for state in states]
+        compact.state_indices = array('l', [state.index for state in states])
+
+        arcs_by_origin = [list() for _ in states]
+        for arc in transducer.get_arcs():
+            arcs_by_origin[state_ids[arc.origin_state]].append(arc)
+
+        cost_offsets = dict()
+        for origin_arcs in arcs_by_origin:
+            for arc in origin_arcs:
+                compact.arc_inputs.append(symbol_table.get_symbol_id(arc.input))
+                compact.arc_outputs.append(symbol_table.get_symbol_id(arc.output))
+                compact.arc_terminals.append(state_ids[arc.terminal_state])
+                compact.arc_cost_offsets.append(compact._add_cost(arc.cost_vector.vector, cost_offsets))
+            compact.state_offsets.append(len(compact.arc_terminals))
+        return compact
+
+    def to_transducer(self):
+        transducer = Transducer(self.alphabet, name=self.name, length_of_cost_vectors=self.length_of_cost_vectors)
+        symbol_table = self.symbol_table
+        states = self.get_labeled_states()
+        for state in states:
+            transducer.add_state(state)
+        transducer.initial_state = states[self.initial_state]
+        transducer.set_final_states([states[i] for i in sorted(self.final_states)])
+
+        for origin_state in range(self.number_of_states):
+            for arc_index in self.get_arc_range(origin_state):
+                transducer.add_arc(Arc(states[origin_state],
+                                       symbol_table.get_symbol(self.arc_inputs[arc_index]),
+                                       symbol_table.get_symbol(self.arc_outputs[arc_index]),
+                                       CostVector(self.get_cost(arc_index)),
+                                       states[self.arc_terminals[arc_index]]))
+        return transducer
+
+    def label_states(self):
+        """makes the state labels of an intersection product explicit, so the product no longer refers to its
+        operands (and to their operands) and they can be dropped"""
+        if self.state_pairs is not None:
+            self.state_labels = [self.get_state_label(state) for state in range(self.number_of_states)]
+            self.state_pairs = None
+            self.operands = None
+
+    def get_labeled_states(self):
+        """the States (with labels and indices) of the transducer, by state id"""
+        return [State(self.get_state_label(state), self.state_indices[state]) for state in range(self.number_of_states)]
+
+    def get_copy(self):
+        """a copy whose weights can be swapped - only the cost pool is copied, the arc arrays are replaced (never
+        changed in place) by the other mutating methods, so they are shared"""
+        transducer_copy = copy(self)
+        transducer_copy.final_states = set(self.final_states)
+        transducer_copy.cost_pool = array('q', self.cost_pool)
+        return transducer_copy
+
+    def _add_cost(self, cost, cost_offsets):
+        offset = cost_offsets.get(cost)
+        if offset is None:
+            offset = len(self.cost_pool)
+            self.cost_pool.extend(cost)
+            cost_offsets[cost] = offset
+        return offset
+
+    def get_cost(self, arc_index):
+        offset = self.arc_cost_offsets[arc_index]
+        return list(self.cost_pool[offset:offset + self.length_of_cost_vectors])
+
+    def get_arc_range(self, state):
+        return range(self.state_offsets[state], self.state_offsets[state + 1])
+
+    def get_number_of_arcs(self):
+        return len(self.arc_terminals)
+
+    def get_size(self):
+        """the number of states and arcs, as Transducer.get_size"""
+        return self.number_of_states + self.get_number_of_arcs()
+
+    def get_length_of_cost_vectors(self):
+        return self.length_of_cost_vectors
+
+    def get_alphabet(self):
+        return self.alphabet
+
+    def get_state_label(self, state):
+        if self.state_pairs is None:
+            return self.state_labels[state]
+        left_transducer, right_transducer = self.operands
+        return "{0}|{1}".format(left_transducer.get_state_label(self.state_pairs[2 * state]),
+                                right_transducer.get_state_label(self.state_pairs[2 * state + 1]))
+
+    def swap_weights_on_arcs(self, i, j):
+        for offset in range(0, len(self.cost_pool), self.length_of_cost_vectors):
+            self.cost_pool[offset + i], self.cost_pool[offset + j] = self.cost_pool[offset + j], self.cost_pool[offset + i]
+
+    @classmethod
+    def _binary_intersection(cls, transducer1, transducer2):
+        """ Intersect two compact transducers, expanding only state pairs reachable from the initial pair
+
+        :type transducer1: CompactTransducer
+        :type transducer2: CompactTransducer
+        :rtype: CompactTransducer
+        """
+        if transducer1.symbol_table is not transducer2.symbol_table:
+            raise ValueError("compact transducers of different symbol tables can not be intersected")
+        symbol_table = transducer1.symbol_table
+        alphabet = list(set(transducer1.alphabet) | set(transducer2.alphabet))
+        cost_vectors_length = transducer1.length_of_cost_vectors + transducer2.length_of_cost_vectors
+        transducer = cls(alphabet, length_of_cost_vectors=cost_vectors_length, symbol_table=symbol_table)
+        transducer.operands = (transducer1, transducer2)
+        transducer.state_pairs = array('l')
+
+        joker_id = symbol_table.joker_id
+        length1 = transducer1.length_of_cost_vectors
+        length2 = transducer2.length_of_cost_vectors
+        pool1, pool2 = transducer1.cost_pool, transducer2.cost_pool
+        cost_offsets = dict()
+        cost_offset_by_pair = dict()
+
+        arcs_by_input_by_state2 = dict()
+
+        def get_arcs_by_input(state2):
+            arcs_by_input = arcs_by_input_by_state2.get(state2)
+            if arcs_by_input is None:
+                arcs_by_input = dict()
+                for arc_index in transducer2.get_arc_range(state2):
+                    arcs_by_input.setdefault(transducer2.arc_inputs[arc_index], []).append(arc_index)
+                arcs_by_input_by_state2[state2] = arcs_by_input
+            return arcs_by_input
+
+        state_ids = dict()
+        number_of_states2 = transducer2.number_of_states
+
+        def get_state_id(state1, state2):
+            key = state1 * number_of_states2 + state2
+            state_id = state_ids.get(key)
+            if state_id is None:
+                state_id = len(state_ids)
+                state_ids[key] = state_id
+                transducer.state_pairs.extend((state1, state2))
+                transducer.state_indices.append(max(transducer1.state_indices[state1],
+                                                    transducer2.state_indices[state2]))
+                if state1 in transducer1.final_states and state2 in transducer2.final_states:
+                    transducer.final_states.add(state_id)
+                queue.append((state1, state2))
+            return state_id
+
+        queue = deque()
+        transducer.initial_state = get_state_id(transducer1.initial_state, transducer2.initial_state)
+        while queue:
+            state1, state2 = queue.popleft()
+            arcs_by_input = get_arcs_by_input(state2)
+            all_arcs2 = transducer2.get_arc_range(state2)
+            for arc1 in transducer1.get_arc_range(state1):
+                input1 = transducer1.arc_inputs[arc1]
+                if input1 == joker_id:
+                    candidates = all_arcs2
+                else:
+                    candidates = arcs_by_input.get(input1, []) + arcs_by_input.get(joker_id, [])
+                output1 = transducer1.arc_outputs[arc1]
+                for arc2 in candidates:
+                    unified_output = symbol_table.intersect(output1, transducer2.arc_outputs[arc2])
+                    if unified_output == NO_SYMBOL:
+                        continue
+                    unified_input = symbol_table.intersect(input1, transducer2.arc_inputs[arc2])
+                    if unified_input == NO_SYMBOL:
+                        continue
+                    offsets_pair = (transducer1.arc_cost_offsets[arc1], transducer2.arc_cost_offsets[arc2])
+                    cost_offset = cost_offset_by_pair.get(offsets_pair)
+                    if cost_offset is None:
+                        offset1, offset2 = offsets_pair
+                        cost = tuple(pool1[offset1:offset1 + length1]) + tuple(pool2[offset2:offset2 + length2])
+                        cost_offset = transducer._add_cost(cost, cost_offsets)
+                        cost_offset_by_pair[offsets_pair] = cost_offset
+                    transducer.arc_inputs.append(unified_input)
+                    transducer.arc_outputs.append(unified_output)
+                    transducer.arc_terminals.append(get_state_id(transducer1.arc_terminals[arc1],
+                                                                 transducer2.arc_terminals[arc2]))
+                    transducer.arc_cost_offsets.append(cost_offset)
+            transducer.state_offsets.append(len(transducer.arc_terminals))
+
+        transducer.number_of_states = len(state_ids)
+        return transducer
+
+    @classmethod
+    def intersection(cls, *transducers):
+        # the product is built from the initial pair onwards, so it has no unreachable states to clear
+        return functools.reduce(cls._binary_intersection, transducers)
+
+    def get_reachable_states(self, state):
+        """the set of states that can be reached from state by following arcs (state included), by one BFS"""
+        reachable_states = {state}
+        states_to_visit = deque([state])
+        while states_to_visit:
+            state = states_to_visit.popleft()
+            for arc_index in self.get_arc_range(state):
+                terminal_state = self.arc_terminals[arc_index]
+                if terminal_state not in reachable_states:
+                    reachable_states.add(terminal_state)
+                    states_to_visit.append(terminal_state)
+        return reachable_states
+
+    def _get_co_reachable_states(self):
+        incoming = [list() for _ in range(self.number_of_states)]
+        for origin_state in range(self.number_of_states):
+            for arc_index in self.get_arc_range(origin_state):
+                incoming[self.arc_terminals[arc_index]].append(origin_state)
+
+        co_reachable_states = set(self.final_states)
+        states_to_visit = deque(self.final_states)
+        while states_to_visit:
+            state = states_to_visit.popleft()
+            for origin_state in incoming[state]:
+                if origin_state not in co_reachable_states:
+                    co_reachable_states.add(origin_state)
+                    states_to_visit.append(origin_state)
+        return co_reachable_states
+
+    def clear_dead_states(self, with_impasse_states=False):
+        """ Removes states that are unreachable from the initial state (and, optionally, states that can not
+        reach a final state), renumbering the remaining states in place. see Transducer.clear_dead_states
+        """
+        alive = self.get_reachable_states(self.initial_state)
+        if with_impasse_states:
+            alive &= self._get_co_reachable_states()
+            alive.add(self.initial_state)
+
+        new_state_ids = array('l', [-1] * self.number_of_states)
+        number_of_alive_states = 0
+        for state in range(self.number_of_states):
+            if state in alive:
+                new_state_ids[state] = number_of_alive_states
+                number_of_alive_states += 1
+        if number_of_alive_states == self.number_of_states:
+            return
+
+        state_offsets = array('l', [0])
+        arc_inputs, arc_outputs, arc_terminals, arc_cost_offsets = array('l'), array('l'), array('l'), array('l')
+        for state in range(self.number_of_states):
+            if state not in alive:
+                continue
+            for arc_index in self.get_arc_range(state):
+                terminal_state = new_state_ids[self.arc_terminals[arc_index]]
+                if terminal_state != -1:
+                    arc_inputs.append(self.arc_inputs[arc_index])
+                    arc_outputs.append(self.arc_outputs[arc_index])
+                    arc_terminals.append(terminal_state)
+                    arc_cost_offsets.append(self.arc_cost_offsets[arc_index])
+            state_offsets.append(len(arc_terminals))
+
+        alive_states = [state for state in range(self.number_of_states) if state in alive]
+        if self.state_pairs is None:
+            self.state_labels = [self.state_labels[state] for state in alive_states]
+        else:
+            self.state_pairs = array('l', [item for state in alive_states
+                                           for item in (self.state_pairs[2 * state], self.state_pairs[2 * state + 1])])
+        self.state_indices = array('l', [self.state_indices[state] for state in alive_states])
+        self.initial_state = new_state_ids[self.initial_state]
+        self.final_states = {new_state_ids[state] for state in self.final_states if state in alive}
+        self.state_offsets = state_offsets
+        self.arc_inputs, self.arc_outputs = arc_inputs, arc_outputs
+        self.arc_terminals, self.arc_cost_offsets = arc_terminals, arc_cost_offsets
+        self.number_of_states = number_of_alive_states
+
+    def keep_arcs(self, is_arc_kept):
+        """removes the arcs for which is_arc_kept(origin state, arc index) is false (the states are kept)"""
+        state_offsets = array('l', [0])
+        arc_inputs, arc_outputs, arc_terminals, arc_cost_offsets = array('l'), array('l'), array('l'), array('l')
+        for state in range(self.number_of_states):
+            for arc_index in self.get_arc_range(state):
+                if is_arc_kept(state, arc_index):
+                    arc_inputs.append(self.arc_inputs[arc_index])
+                    arc_outputs.append(self.arc_outputs[arc_index])
+                    arc_terminals.append(self.arc_terminals[arc_index])
+                    arc_cost_offsets.append(self.arc_cost_offsets[arc_index])
+            state_offsets.append(len(arc_terminals))
+        self.state_offsets = state_offsets
+        self.arc_inputs, self.arc_outputs = arc_inputs, arc_outputs
+        self.arc_terminals, self.arc_cost_offsets = arc_terminals, arc_cost_offsets
+
+    def get_range(self):
+        """
+        returns a set of strings, see Transducer.get_range
+        """
+        strings_by_state = self.get_strings_by_state(self.initial_state)
+        strings = set()
+        for state in self.final_states:
+            strings.update(strings_by_state[state])
+        return strings
+
+    def get_strings_by_state(self, initial_state, is_arc_included=None):
+        """
+        returns a list, by state id, of the sets of output strings of the paths from initial_state to each state,
+        following only the arcs for which is_arc_included(origin state, arc index) (when given) is true. see
+        Transducer.get_strings_by_state
+        """
+        symbol_table = self.symbol_table
+        alphabet_symbols = [segment.get_symbol() for segment in self.alphabet]
+        strings_by_state = [set() for _ in range(self.number_of_states)]
+        strings_by_state[initial_state].add('')
+
+        active_states = {initial_state}
+        while active_states:
+            next_pass_states = set()
+            for state in active_states:
+                state_strings = list(strings_by_state[state])
+                for arc_index in self.get_arc_range(state):
+                    if is_arc_included is not None and not is_arc_included(state, arc_index):
+                        continue
+                    terminal_state = self.arc_terminals[arc_index]
+                    next_pass_states.add(terminal_state)
+                    terminal_strings = strings_by_state[terminal_state]
+                    for string2 in symbol_table.get_output_strings(self.arc_outputs[arc_index], alphabet_symbols):
+                        for string1 in state_strings:
+                            terminal_strings.add(string1 + string2)
+            active_states = next_pass_states
+        return strings_by_state
+
+    def get_info(self):
+        return "the compact transducer has {} arcs, {} states and {} distinct cost vectors".format(
+            self.get_number_of_arcs(), self.number_of_states,
+            len(self.cost_pool) // self.length_of_cost_vectors if self.length_of_cost_vectors else 1)
+
+    def dot_representation(self):
+        return self.to_transducer().dot_representation()
+
+    def __str__(self):
+        return str(self.to_transducer())
+
+    def __repr__(self):
+        return self.__str__()
@@ -7,6 +7,7 @@ from transducer import CostVector, Arc, State, Transducer
 from segment import NULL_SEGMENT, JOKER_SEGMENT, Segment
 from itertools import permutations
 from utils import get_configuration, get_feature_table
+from bounded_cache import BoundedCache
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +15,8 @@ logger = logging.getLogger(__name__)
 # A global variable that holds all the names of constraint classes that inherit from ConstraintMetaClass
 _all_constraints = list()
 
-constraint_transducers = dict()
+constraint_transducers = BoundedCache("constraint transducers", "CONSTRAINT_TRANSDUCERS_CACHE_SIZE",
+                                      "CONSTRAINT_TRANSDUCERS_CACHE_TOTAL_SIZE", Transducer.get_size)
 
 
 def get_number_of_constraints():
@@ -45,6 +47,9 @@ class Constraint(metaclass=ConstraintMetaClass):
             else:
                 raise ValueError("Not a dict or FeatureBundle")
 
+    def get_copy(self):
+        return type(self)([feature_bundle.get_copy() for feature_bundle in self.feature_bundles])
+
     def augment_feature_bundle(self):
         success = choice(self.feature_bundles).augment_feature_bundle()
         if success:
@@ -76,17 +81,15 @@ class Constraint(metaclass=ConstraintMetaClass):
 
     def get_transducer(self):
         constraint_key = str(self)
-        if constraint_key in constraint_transducers:
-            return constraint_transducers[constraint_key]
-        else:
+        transducer = constraint_transducers.get(constraint_key)
+        if transducer is None:
             transducer = self._make_transducer()
             constraint_transducers[constraint_key] = transducer
-            return transducer
+        return transducer
 
     @staticmethod
     def clear_caching():
-        global constraint_transducers
-        constraint_transducers = dict()
+        constraint_transducers.clear()
 
     def __eq__(self, other):
         if type(self) == type(other):
@@ -1,12 +1,13 @@
 import json
 import logging
-import pickle
+from copy import copy
 
 from io import StringIO
 
 from random import choice, randrange
 from constraint import Constraint, get_number_of_constraints
-from transducer import Transducer
+from compact_transducer import CompactTransducer, SymbolTable
+from bounded_cache import BoundedCache
 from constraint import MaxConstraint, DepConstraint, PhonotacticConstraint, IdentConstraint
 from utils import get_configuration, get_feature_table, get_feature_table, get_weighted_list, ceiling_of_log_two
 
@@ -14,7 +15,8 @@ logger = logging.getLogger(__name__)
 
 constraints_delimiter_for_printing = " >> "
 
-constraint_set_transducers = dict()
+constraint_set_transducers = BoundedCache("constraint set transducers", "CONSTRAINT_SET_TRANSDUCERS_CACHE_SIZE",
+                                          "CONSTRAINT_SET_TRANSDUCERS_CACHE_TOTAL_SIZE", CompactTransducer.get_size)
 
 demote_caching_flag = True
 
@@ -47,6 +49,28 @@ class ConstraintSet:
         weighted_mutation_function_list = get_weighted_list(mutation_weights)
         return choice(weighted_mutation_function_list)()
 
+    def get_copy(self):
+        """a copy to mutate - the constraints (and their feature bundles) are copied"""
+        constraint_set_copy = copy(self)
+        constraint_set_copy.constraints = [constraint.get_copy() for constraint in self.constraints]
+        return constraint_set_copy
+
+    def make_undoable_mutation(self):
+        """make_mutation in place, returning the mutation result and an undo record for undo_mutation - the original
+        list of constraints. the mutation works on a new list, and a constraint is replaced with a copy before it is
+        mutated (_replace_with_copy), so the original list and its constraints are never modified"""
+        constraints = self.constraints
+        self.constraints = list(constraints)
+        return self.make_mutation(), constraints
+
+    def undo_mutation(self, undo_record):
+        self.constraints = undo_record
+
+    def _replace_with_copy(self, constraint):
+        index = next(i for i, constraint_ in enumerate(self.constraints) if constraint_ is constraint)
+        self.constraints[index] = constraint.get_copy()
+        return self.constraints[index]
+
     def _remove_constraint(self):
         logger.debug("_remove_constraint")
         if len(self.constraints) > get_configuration("MIN_NUMBER_OF_CONSTRAINTS_IN_CONSTRAINT_SET"):
@@ -63,7 +87,7 @@ class ConstraintSet:
         logger.debug("_insert_feature_bundle_phonotactic_constraint")
         phonotactic_constraints = list(filter(lambda x: x.get_constraint_name() == "Phonotactic", self.constraints))
         if phonotactic_constraints:
-            if choice(phonotactic_constraints).insert_feature_bundle():
+            if self._replace_with_copy(choice(phonotactic_constraints)).insert_feature_bundle():
                 return True
             else:  # augment_constraint did not succeed
                 return False
@@ -77,7 +101,7 @@ class ConstraintSet:
         logger.debug("_remove_feature_bundle_phonotactic_constraint")
         phonotactic_constraints = list(filter(lambda x: x.get_constraint_name() == "Phonotactic", self.constraints))
         if phonotactic_constraints:
-            if choice(phonotactic_constraints).remove_feature_bundle():
+            if self._replace_with_copy(choice(phonotactic_constraints)).remove_feature_bundle():
                 return True
             else:  # augment_constraint did not succeed
                 return False
@@ -88,7 +112,7 @@ class ConstraintSet:
         logger.debug("_augment_feature_bundle")
         augmentable_constraints = list(filter(lambda x: x.get_constraint_name() != "Faith", self.constraints))
         if augmentable_constraints:
-            if choice(augmentable_constraints).augment_feature_bundle():
+            if self._replace_with_copy(choice(augmentable_constraints)).augment_feature_bundle():
                 return True
             else:  # augment_feature_bundle did not succeed
                 return False
@@ -101,7 +125,7 @@ class ConstraintSet:
         if len(self.constraints) > 1:
 
             if demote_caching_flag:
-                transducer = pickle.loads(pickle.dumps(self.get_transducer(), -1))
+                transducer = self.get_transducer().get_copy()
 
             index_of_demotion = randrange(len(self.constraints)-1)  # index of a random constraint
             i = index_of_demotion                                      # (which is not the lowest ranked)
@@ -138,25 +162,28 @@ class ConstraintSet:
             return False
 
     def get_transducer(self):
+        """the intersection of the constraint transducers, as a CompactTransducer (see Grammar.get_transducer)"""
         constraint_set_key = str(self)
-        if constraint_set_key in constraint_set_transducers:
-            return constraint_set_transducers[constraint_set_key]
-        else:
+        transducer = constraint_set_transducers.get(constraint_set_key)
+        if transducer is None:
             transducer = self._make_transducer()
             constraint_set_transducers[constraint_set_key] = transducer
-            return transducer
+        return transducer
 
     def _make_transducer(self):
-        if len(self.constraints) is 1:                             # if there is only on constraint in the
-            return pickle.loads(pickle.dumps(self.constraints[0].get_transducer(), -1))  # constraint set there is no need to intersect
+        symbol_table = SymbolTable()  # of the transducers of this constraint set, dropped with them
+        constraints_transducers = [CompactTransducer.from_transducer(constraint.get_transducer(), symbol_table)
+                                   for constraint in self.constraints]
+        if len(constraints_transducers) == 1:  # if there is only one constraint in the constraint set there is no
+            return constraints_transducers[0]  # need to intersect
         else:
-            constraints_transducers = [constraint.get_transducer() for constraint in self.constraints]
-            return Transducer.intersection(*constraints_transducers)
+            transducer = CompactTransducer.intersection(*constraints_transducers)
+            transducer.label_states()  # the intersection keeps none of the constraint transducers
+            return transducer
 
     @staticmethod
     def clear_caching():
-        global constraint_set_transducers
-        constraint_set_transducers = dict()
+        constraint_set_transducers.clear()
 
     @classmethod
     def loads(cls, constraint_set_json_str):
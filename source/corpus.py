@@ -1,18 +1,72 @@
+import gzip
+import sys
+from collections import Counter
+from itertools import groupby
+from os.path import splitext
+
 from utils import get_configuration, get_feature_table
 
 
 class Corpus:
+    """the words of a simulation, duplicated by CORPUS_DUPLICATION_FACTOR. the duplicates are not stored - a word has
+    a count, and the energy of a hypothesis evaluates every distinct word once (see CorpusIndex)"""
     def __init__(self, string_words):
+        self._count_words((word, len(list(repeats))) for word, repeats in groupby(string_words))
+
+    @classmethod
+    def load(cls, corpus_file_name):
+        """a corpus read from a file with a word, or a word and its count separated by a tab, in every line (see
+        read_corpus_file). the file is read once and every distinct word is stored once with its count, so the words
+        of a loaded corpus are ordered by their first appearance, with their repeats together"""
+        count_by_word = dict()
+        for word, count in read_corpus_file(corpus_file_name):
+            count_by_word[word] = count_by_word.get(word, 0) + count
+        corpus = cls.__new__(cls)
+        corpus._count_words(count_by_word.items())
+        return corpus
+
+    def _count_words(self, word_counts):
+        """counts the pairs of a word and the number of its consecutive repeats, in the order of the corpus. the
+        fraction of CORPUS_DUPLICATION_FACTOR duplicates the first words of the corpus"""
         duplication_factor = get_configuration("CORPUS_DUPLICATION_FACTOR")
-        n = len(string_words)
-        duplication_factor_int = int(duplication_factor)
+        self.duplication_factor_int = int(duplication_factor)
         duplication_factor_fraction = duplication_factor - int(duplication_factor)
-        words_after_duplication = string_words * duplication_factor_int
-        words_after_duplication.extend(string_words[:int(n*duplication_factor_fraction)])
-        self.words = words_after_duplication
+        self.word_counts = list()
+        self.count_by_word = Counter()
+        self.max_word_length = 0
+        n = 0
+        for word, count in word_counts:
+            self.word_counts.append((word, count))
+            n += count
+            if self.duplication_factor_int:
+                self.count_by_word[word] += count * self.duplication_factor_int
+                self.max_word_length = max(self.max_word_length, len(word))
+        self.number_of_fraction_words = int(n*duplication_factor_fraction)
+        number_of_remaining_fraction_words = self.number_of_fraction_words
+        for word, count in self.word_counts:
+            if not number_of_remaining_fraction_words:
+                break
+            fraction_count = min(count, number_of_remaining_fraction_words)
+            self.count_by_word[word] += fraction_count
+            self.max_word_length = max(self.max_word_length, len(word))
+            number_of_remaining_fraction_words -= fraction_count
 
     def get_words(self):
-        return self.words[:]
+        """all the words, with their duplicates"""
+        string_words = [word for word, count in self.word_counts for _ in range(count)]
+        return string_words * self.duplication_factor_int + string_words[:self.number_of_fraction_words]
+
+    def get_distinct_words(self):
+        return [word for word, count in self.count_by_word.items() if count]
+
+    def get_count(self, word):
+        return self.count_by_word.get(word, 0)
+
+    def get_index(self):
+        return CorpusIndex({word: count for word, count in self.count_by_word.items() if count})
+
+    def get_max_word_length(self):
+        return self.max_word_length
 
     def __str__(self):
         return "Corpus with {0} words".format(len(self))
@@ -21,7 +75,56 @@ class Corpus:
         return self.__str__()
 
     def __getitem__(self, item):
-        return self.words.__getitem__(item)
+        return self.get_words().__getitem__(item)
+
+    def __len__(self):
+        return sum(self.count_by_word.values())
+
+
+def read_corpus_file(corpus_file_name):
+    """yields the pairs of a word and its count from a corpus file, a line at a time. a line is a word (with the
+    count 1) or a word and its count separated by a tab, and empty lines are skipped. the words are interned, so a
+    word is stored once however many times it appears. a file name that ends with .gz is read as gzip"""
+    if splitext(corpus_file_name)[1] == ".gz":
+        file = gzip.open(corpus_file_name, "rt", encoding="utf-8")
+    else:
+        file = open(corpus_file_name, "r", encoding="utf-8")
+    with file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            word, _, count = line.partition("\t")
+            yield sys.intern(word.strip()), int(count) if count else 1
+
+
+class CorpusIndex:
+    """the distinct words of a corpus with their multiplicities, and the set of their prefixes (for generation that
+    is pruned to the corpus, see Grammar.get_data_outputs_of_words)"""
+    def __init__(self, multiplicity_by_word):
+        self.multiplicity_by_word = multiplicity_by_word
+        self.prefixes = {word[:i] for word in self.multiplicity_by_word for i in range(len(word) + 1)}
+
+    @classmethod
+    def from_words(cls, string_words):
+        """the index of a list of words, in which a word is repeated by its multiplicity"""
+        return cls(Counter(string_words))
+
+    def is_prefix(self, string):
+        return string in self.prefixes
+
+    def get_multiplicity(self, word):
+        return self.multiplicity_by_word.get(word, 0)
+
+    def get_distinct_words(self):
+        return self.multiplicity_by_word.keys()
+
+    def get_multiplicities(self):
+        """pairs of a distinct word and its multiplicity"""
+        return self.multiplicity_by_word.items()
+
+    def __contains__(self, word):
+        return word in self.multiplicity_by_word
 
     def __len__(self):
-        return len(self.words)
+        return len(self.multiplicity_by_word)
@@ -19,6 +19,12 @@ class FeatureBundle:
 
         self.feature_dict = feature_dict
 
+    def get_copy(self):
+        feature_bundle_copy = FeatureBundle.__new__(FeatureBundle)
+        feature_bundle_copy.feature_table = self.feature_table
+        feature_bundle_copy.feature_dict = dict(self.feature_dict)
+        return feature_bundle_copy
+
     def get_encoding_length(self):
         return 2 * len(self.feature_dict)
 
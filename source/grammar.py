@@ -1,17 +1,31 @@
 import inspect
 import logging
+import multiprocessing
+from collections import namedtuple
+from operator import attrgetter
 from random import choice
 
 from debug_tools import write_to_dot as dot
-from transducer import Transducer
-from transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths
+from transducer import Transducer, CostVector
+from segment import NULL_SEGMENT, JOKER_SEGMENT
+from transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths, get_cost_packer
+from transducers_disk_cache import load_transducer, store_transducer
 from utils import get_configuration, get_feature_table, get_weighted_list
+from bounded_cache import BoundedCache
+from word import Word
 
 logger = logging.getLogger(__name__)
 
-outputs_by_constraint_set_and_word = dict()
+outputs_by_constraint_set_and_word = BoundedCache("grammar outputs", "GRAMMAR_OUTPUTS_CACHE_SIZE")
 
-grammar_transducers = dict()
+grammar_transducers = BoundedCache("grammar transducers", "GRAMMAR_TRANSDUCERS_CACHE_SIZE",
+                                   "GRAMMAR_TRANSDUCERS_CACHE_TOTAL_SIZE", Transducer.get_size)
+
+cost_packers = BoundedCache("cost packers", "COST_PACKERS_CACHE_SIZE")
+
+_missing = object()
+
+GrammarUndoRecord = namedtuple('GrammarUndoRecord', ['mutated_object', 'undo_record'])
 
 
 class Grammar:
@@ -37,14 +51,44 @@ class Grammar:
             mutation_result = object_.make_mutation()
         return mutation_result
 
+    def get_neighbor(self):
+        """a mutated copy of the grammar, with the mutation result.
+        the same choice as make_mutation, but the copy shares the component that is not mutated (the constraint set or
+        the lexicon) with this grammar, and only the mutated one is copied. a shared component is never mutated, so
+        a rejected neighbor is just dropped"""
+        mutation_weights = [(self.lexicon, get_configuration("MUTATE_LEXICON")),
+                            (self.constraint_set, get_configuration("MUTATE_CONSTRAINT_SET"))]
+        mutatable_object = choice(get_weighted_list(mutation_weights))
+        if mutatable_object is self.lexicon:
+            neighbor = Grammar(self.constraint_set, self.lexicon.get_copy())
+            mutation_result = neighbor.lexicon.make_mutation()
+        else:
+            neighbor = Grammar(self.constraint_set.get_copy(), self.lexicon)
+            mutation_result = neighbor.constraint_set.make_mutation()
+        return mutation_result, neighbor
+
+    def make_undoable_mutation(self):
+        """make_mutation in place, returning the mutation result and a GrammarUndoRecord for undo_mutation.
+        the choice is that of make_mutation and get_neighbor"""
+        mutation_weights = [(self.lexicon, get_configuration("MUTATE_LEXICON")),
+                            (self.constraint_set, get_configuration("MUTATE_CONSTRAINT_SET"))]
+        mutatable_object = choice(get_weighted_list(mutation_weights))
+        mutation_result, undo_record = mutatable_object.make_undoable_mutation()
+        return mutation_result, GrammarUndoRecord(mutatable_object, undo_record)
+
+    def undo_mutation(self, undo_record):
+        undo_record.mutated_object.undo_mutation(undo_record.undo_record)
+
     def get_transducer(self):
             constraint_set_key = str(self.constraint_set) # constraint_set is the identifier of the grammar transducer
-            if constraint_set_key in grammar_transducers:
-                return grammar_transducers[constraint_set_key]
-            else:
-                transducer = self._make_transducer()
+            transducer = grammar_transducers.get(constraint_set_key)
+            if transducer is None:
+                transducer = load_transducer(constraint_set_key)
+                if transducer is None:
+                    transducer = self._make_transducer()
+                    store_transducer(constraint_set_key, transducer)
                 grammar_transducers[constraint_set_key] = transducer
-                return transducer
+            return transducer
 
     def _make_transducer(self):
         constraint_set_transducer = self.constraint_set.get_transducer()
@@ -61,12 +105,160 @@ class Grammar:
 
     def generate(self, word):
         constraint_set_and_word_key = str(self.constraint_set) + str(word)
-        if constraint_set_and_word_key in outputs_by_constraint_set_and_word:
-            return outputs_by_constraint_set_and_word[constraint_set_and_word_key]
-        else:
+        outputs = outputs_by_constraint_set_and_word.get(constraint_set_and_word_key)
+        if outputs is None:
             outputs = self._get_outputs(word)
             outputs_by_constraint_set_and_word[constraint_set_and_word_key] = outputs
-            return outputs
+        return outputs
+
+    def generate_all(self, words):
+        """the outputs of each of the words, as a dict. when GENERATION_PROCESSES > 1 and more than
+        GENERATION_CHUNK_SIZE words are not cached, they are generated in chunks by a pool of forked processes.
+        the grammar transducer is made before the fork, so the processes share it instead of receiving it"""
+        outputs_by_word = dict()
+        words_to_generate = list()
+        constraint_set_key = str(self.constraint_set)
+        for word in words:
+            outputs = outputs_by_constraint_set_and_word.get(constraint_set_key + str(word))
+            if outputs is None:
+                words_to_generate.append(word)
+            else:
+                outputs_by_word[word] = outputs
+
+        number_of_processes = get_configuration("GENERATION_PROCESSES")
+        chunk_size = get_configuration("GENERATION_CHUNK_SIZE")
+        if number_of_processes > 1 and len(words_to_generate) > chunk_size:
+            grammar_transducer = self.get_transducer()
+            self._get_cost_packer(grammar_transducer, min(len(word) for word in words_to_generate))
+            chunks = [words_to_generate[i:i + chunk_size] for i in range(0, len(words_to_generate), chunk_size)]
+            with multiprocessing.get_context("fork").Pool(number_of_processes, initializer=_set_generation_grammar,
+                                                          initargs=(self,)) as pool:
+                chunks_outputs = pool.imap(_generate_word_strings, [[str(word) for word in chunk] for chunk in chunks])
+                for chunk, chunk_outputs in zip(chunks, chunks_outputs):  # outputs are merged as chunks finish
+                    for word, outputs in zip(chunk, chunk_outputs):
+                        outputs_by_constraint_set_and_word[constraint_set_key + str(word)] = outputs
+                        outputs_by_word[word] = outputs
+        else:
+            for word, outputs in self._get_outputs_of_words(words_to_generate).items():
+                outputs_by_constraint_set_and_word[constraint_set_key + str(word)] = outputs
+                outputs_by_word[word] = outputs
+        return outputs_by_word
+
+    def _get_outputs_of_words(self, words):
+        """the outputs of the words (as _get_outputs), as a dict, from one pass over the trie of the words instead
+        of an intersection per word (see _get_outputs_of_prefix_tree)"""
+        if not words:
+            return dict()
+        if not self._is_consuming_segments_on_all_arcs():
+            return {word: self._get_outputs(word) for word in words}
+
+        trie = _WordsTrieNode()
+        for word in words:
+            trie.add(word)
+        outputs_by_word = {word: set() for word in words}
+        for node, outputs in self._get_outputs_of_prefix_tree(trie, max(len(word) for word in words)):
+            for word in node.words:
+                outputs_by_word[word] = outputs
+        return outputs_by_word
+
+    def get_data_outputs_of_words(self, words, corpus_index):
+        """the outputs of the words that are in the corpus (see CorpusIndex), for the words that have such outputs.
+        the pass over the trie of the words keeps only the output strings that are prefixes of corpus words, and
+        skips the subtrees without any"""
+        if not words:
+            return dict()
+        if not self._is_consuming_segments_on_all_arcs():
+            outputs_by_word = self.generate_all(words)
+            return _get_data_outputs_by_word(outputs_by_word, corpus_index)
+        trie = _WordsTrieNode()
+        for word in words:
+            trie.add(word)
+        data_outputs_by_word = dict()
+        for node, data_outputs in self._get_outputs_of_prefix_tree(trie, max(len(word) for word in words),
+                                                                   corpus_index):
+            for word in node.words:
+                data_outputs_by_word[word] = data_outputs
+        return data_outputs_by_word
+
+    def generate_lexicon(self, corpus_index=None):
+        """the outputs of the lexicon words that have outputs, by word string, from one pass over the prefix tree of
+        the nfa of the lexicon HMM (see HMM.get_prefix_tree) - the lexicon words are not enumerated.
+        with a corpus_index only the outputs that are in the corpus are generated, as in get_data_outputs_of_words"""
+        max_word_length = self.lexicon.max_word_length_in_data
+        if not self._is_consuming_segments_on_all_arcs():
+            outputs_by_word = self.generate_all(self.lexicon.get_words())
+            if corpus_index is not None:
+                outputs_by_word = _get_data_outputs_by_word(outputs_by_word, corpus_index)
+            return {str(word): outputs for word, outputs in outputs_by_word.items() if outputs}
+        prefix_tree = self.lexicon.hmm.get_prefix_tree(max_word_length)
+        return {node.prefix: outputs for node, outputs in
+                self._get_outputs_of_prefix_tree(prefix_tree, max_word_length, corpus_index)}
+
+    def _is_consuming_segments_on_all_arcs(self):
+        return not any(arc.input in (NULL_SEGMENT, JOKER_SEGMENT) for arc in self.get_transducer().get_arcs())
+
+    def _get_outputs_of_prefix_tree(self, root, max_word_length, corpus_index=None):
+        """yields (node, outputs) for the nodes of a prefix tree that end a word with outputs. a node has
+        get_children(), pairs of a segment symbol and a child node, and ends_word().
+        with a corpus_index only the outputs that are in the corpus are yielded (see get_data_outputs_of_words).
+
+        every arc of the grammar transducer consumes a segment, so the paths for a word are the paths of its
+        prefixes extended by an arc, and the most harmonic paths into (node, grammar state) are shared by all
+        the words with the prefix of the node. the pass keeps for every grammar state the cost of the most harmonic
+        paths into it and the set of their outputs, and extends them from a node to its children. the result for a
+        word is that of intersecting its transducer with the grammar transducer and keeping the most harmonic paths
+        (see _get_outputs), without building the intersection"""
+        grammar_transducer = self.get_transducer()
+        cost_packer = self._get_cost_packer(grammar_transducer, max_word_length)
+        if cost_packer:
+            get_arc_cost, initial_cost = cost_packer.pack_arc_cost, 0
+        else:
+            get_arc_cost = attrgetter("cost_vector")
+            initial_cost = CostVector.get_vector(grammar_transducer.get_length_of_cost_vectors(), 0)
+        arcs_by_state_and_symbol = dict()
+        for arc in grammar_transducer.get_arcs():
+            arcs_by_symbol = arcs_by_state_and_symbol.setdefault(arc.origin_state, dict())
+            arcs_by_symbol.setdefault(arc.input.get_symbol(), list()).append(
+                (get_arc_cost(arc), arc.output, arc.terminal_state))
+
+        final_states = grammar_transducer.get_final_states()
+        initial_state = grammar_transducer.initial_state
+        nodes_to_visit = [(root, {initial_state: initial_cost}, {initial_state: {''}})]
+        while nodes_to_visit:
+            node, cost_by_state, strings_by_state = nodes_to_visit.pop()
+            if node.ends_word():
+                final_costs = [cost_by_state[state] for state in final_states if state in cost_by_state]
+                if final_costs:
+                    best_final_cost = max(final_costs)
+                    outputs = set()
+                    for state in final_states:
+                        if state in cost_by_state and cost_by_state[state] == best_final_cost:
+                            outputs.update(strings_by_state[state])
+                    if corpus_index is not None:
+                        outputs = {output for output in outputs if output in corpus_index}
+                    if outputs:
+                        yield node, outputs
+            for symbol, child in node.get_children():
+                child_cost_by_state = dict()
+                child_strings_by_state = dict()
+                for state, state_cost in cost_by_state.items():
+                    state_strings = strings_by_state[state]
+                    for arc_cost, arc_output, terminal_state in arcs_by_state_and_symbol.get(state, {}).get(symbol, ()):
+                        cost = state_cost + arc_cost
+                        if terminal_state not in child_cost_by_state or cost > child_cost_by_state[terminal_state]:
+                            child_cost_by_state[terminal_state] = cost
+                            child_strings_by_state[terminal_state] = set()
+                        elif cost != child_cost_by_state[terminal_state]:
+                            continue
+                        strings = (string + output for string in state_strings for output in arc_output)
+                        if corpus_index is not None:
+                            # the costs of the paths are kept, they decide which outputs are optimal
+                            strings = filter(corpus_index.is_prefix, strings)
+                        child_strings_by_state[terminal_state].update(strings)
+                if corpus_index is not None and not any(child_strings_by_state.values()):
+                    continue  # no word with the child's prefix has an output in the corpus
+                if child_cost_by_state:  # otherwise no word with the child's prefix has outputs
+                    nodes_to_visit.append((child, child_cost_by_state, child_strings_by_state))
 
     def _get_outputs(self, word):
         grammar_transducer = self.get_transducer()
@@ -75,11 +267,24 @@ class Grammar:
                                                          grammar_transducer) # a transducer with segments on inputs and sets on outputs
 
         intersected_transducer.clear_dead_states()
-        intersected_transducer = optimize_transducer_grammar_for_word(word, intersected_transducer)
+        intersected_transducer = optimize_transducer_grammar_for_word(word, intersected_transducer,
+                                                                      self._get_cost_packer(grammar_transducer, len(word)))
         #dot(intersected_transducer, 'intersected')
         outputs = intersected_transducer.get_range()
         return outputs
 
+    def _get_cost_packer(self, grammar_transducer, word_length):
+        """packs the costs of the paths of the grammar transducer for words up to the longest word in the data.
+        None (CostVectors are used) for longer words, or if packed costs would not fit a machine word"""
+        if self.lexicon is None or word_length > self.lexicon.max_word_length_in_data:
+            return None
+        cost_packer_key = (str(self.constraint_set), self.lexicon.max_word_length_in_data)
+        cost_packer = cost_packers.get(cost_packer_key, _missing)  # None is a valid cost packer
+        if cost_packer is _missing:
+            cost_packer = get_cost_packer(grammar_transducer, self.lexicon.max_word_length_in_data)
+            cost_packers[cost_packer_key] = cost_packer
+        return cost_packer
+
     def __str__(self):
         return "Grammar with [{0}]; and [{1}]".format(self.constraint_set, self.lexicon)
 
@@ -91,8 +296,49 @@ class Grammar:
 
     @staticmethod
     def clear_caching():
-            global outputs_by_constraint_set_and_word
-            outputs_by_constraint_set_and_word = dict()
+            outputs_by_constraint_set_and_word.clear()
+            grammar_transducers.clear()
+            cost_packers.clear()
+
+
+def _get_data_outputs_by_word(outputs_by_word, corpus_index):
+    data_outputs_by_word = dict()
+    for word, outputs in outputs_by_word.items():
+        data_outputs = {output for output in outputs if output in corpus_index}
+        if data_outputs:
+            data_outputs_by_word[word] = data_outputs
+    return data_outputs_by_word
+
+
+_generation_grammar = None  # the grammar of a generate_all process
+
+
+def _set_generation_grammar(grammar):
+    global _generation_grammar
+    _generation_grammar = grammar
+
+
+def _generate_word_strings(word_strings):
+    words = [Word(word_string) for word_string in word_strings]
+    outputs_by_word = _generation_grammar._get_outputs_of_words(words)
+    return [outputs_by_word[word] for word in words]
+
+
+class _WordsTrieNode:
+    __slots__ = ["children", "words"]
+
+    def __init__(self):
+        self.children = dict()
+        self.words = list()  # the words that end at the node
+
+    def get_children(self):
+        return self.children.items()
+
+    def ends_word(self):
+        return bool(self.words)
 
-            global grammar_transducers
-            grammar_transducers = dict()
\ No newline at end of file
+    def add(self, word):
+        node = self
+        for segment in word.get_segments():
+            node = node.children.setdefault(segment.get_symbol(), _WordsTrieNode())
+        node.words.append(word)
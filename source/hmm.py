@@ -1,6 +1,6 @@
 from random import choice, randint
 from collections import namedtuple
-from copy import deepcopy
+from copy import copy, deepcopy
 from io import StringIO
 from utils import get_configuration, get_feature_table, get_weighted_list, ceiling_of_log_two
 from FAdo.fa import NFA, Epsilon
@@ -17,6 +17,25 @@ q3 = 'q3'
 StateTuple = namedtuple('StateTuple', ['start_state', 'end_state'])
 
 
+def get_hmm_state(nfa_state):
+    """the HMM state of a state of HMM.nfa - q1 for q1_start, q1_end and the emission states q1,i,j"""
+    return nfa_state.split(",")[0].rsplit("_", 1)[0]
+
+
+class HMMUndoRecord:
+    """what make_undoable_mutation changed: the original transitions and emissions lists of the changed states
+    (None where a state had none), the original inner states list and the original nfa"""
+    __slots__ = ["saved_states", "inner_states", "nfa"]
+
+    def __init__(self, hmm):
+        self.saved_states = dict()
+        self.inner_states = hmm.inner_states
+        self.nfa = hmm.nfa
+
+    def get_changed_states(self):
+        return set(self.saved_states)
+
+
 class HMM:
     def __init__(self, transitions, emissions, inner_states):
         self.feature_table = get_feature_table()
@@ -24,6 +43,7 @@ class HMM:
         self.emissions: Dict = emissions
         self.inner_states: List = inner_states
         self.nfa = self._get_nfa()
+        self.undo_record = None  # of the mutation in progress
 
     @classmethod
     def create_hmm_from_list(cls, word_string_list):
@@ -68,6 +88,44 @@ class HMM:
             self.nfa = self._get_nfa()
         return mutation_result
 
+    def make_undoable_mutation(self):
+        """make_mutation in place, returning the mutation result and an HMMUndoRecord for undo_mutation.
+        the mutation operators call _save_state before they change a state, which moves the original lists
+        of the state to the record and leaves copies to be changed - the original lists are never modified"""
+        self.undo_record = HMMUndoRecord(self)
+        self.inner_states = list(self.inner_states)
+        try:
+            return self.make_mutation(), self.undo_record
+        finally:
+            self.undo_record = None
+
+    def undo_mutation(self, undo_record):
+        for state, (transitions, emissions) in undo_record.saved_states.items():
+            for dict_, list_ in [(self.transitions, transitions), (self.emissions, emissions)]:
+                if list_ is None:
+                    dict_.pop(state, None)
+                else:
+                    dict_[state] = list_
+        self.inner_states = undo_record.inner_states
+        self.nfa = undo_record.nfa
+
+    def _save_state(self, state):
+        if self.undo_record is None or state in self.undo_record.saved_states:
+            return
+        self.undo_record.saved_states[state] = (self.transitions.get(state), self.emissions.get(state))
+        if state in self.transitions:
+            self.transitions[state] = list(self.transitions[state])
+        if state in self.emissions:
+            self.emissions[state] = list(self.emissions[state])
+
+    def get_copy(self):
+        """a copy to mutate - the transitions and emissions are copied, the nfa is shared until a mutation replaces it"""
+        hmm_copy = copy(self)
+        hmm_copy.transitions = {state: list(states) for state, states in self.transitions.items()}
+        hmm_copy.emissions = {state: list(emissions) for state, emissions in self.emissions.items()}
+        hmm_copy.inner_states = list(self.inner_states)
+        return hmm_copy
+
     def advance_emission(self):
         target_state = choice(self.inner_states)
         target_state_emissions = self.get_emissions(target_state)
@@ -79,6 +137,8 @@ class HMM:
             new_state = self._get_next_state()
             emission = choice(target_state_emissions)
 
+            self._save_state(target_state)
+            self._save_state(new_state)
             self.inner_states.append(new_state)
             self.transitions[new_state] = [outgoing_state, new_state, target_state]
             self.emissions[new_state] = [emission]
@@ -95,12 +155,14 @@ class HMM:
         if len(self.inner_states) < get_configuration("MAX_NUM_OF_INNER_STATES"):
             original_state = choice(self.inner_states)
             cloned_state = self._get_next_state()
+            self._save_state(cloned_state)
             self.inner_states.append(cloned_state)
             self.emissions[cloned_state] = deepcopy(self.emissions[original_state])
 
             #create incoming connections
             for state in self.transitions:
                 if original_state in self.transitions[state]:
+                    self._save_state(state)
                     self.transitions[state].append(cloned_state)
 
             #copy outgoing connections
@@ -119,6 +181,7 @@ class HMM:
         emission = choice(emissions)
         state = choice(self.inner_states)
         if emission not in self.get_emissions(state):
+            self._save_state(state)
             self.emissions[state].append(emission)
             return True
         else:
@@ -128,6 +191,7 @@ class HMM:
         """adds empty state"""
         if len(self.inner_states) < get_configuration("MAX_NUM_OF_INNER_STATES"):
             new_state = self._get_next_state()
+            self._save_state(new_state)
             self.inner_states.append(new_state)
             self.emissions[new_state] = []
             self.transitions[new_state] = []
@@ -139,12 +203,14 @@ class HMM:
         """removes an inner state (and all it's arcs)"""
         if len(self.inner_states) > get_configuration("MIN_NUM_OF_INNER_STATES"):
             state_to_remove = choice(self.inner_states)
+            self._save_state(state_to_remove)
             self.inner_states.remove(state_to_remove)
             del self.emissions[state_to_remove]
             del self.transitions[state_to_remove]
 
             for state in self.transitions:
                 if state_to_remove in self.transitions[state]:
+                    self._save_state(state)
                     self.transitions[state].remove(state_to_remove)
             return True
         else:
@@ -156,6 +222,7 @@ class HMM:
         state1 = choice(self.inner_states + [INITIAL_STATE])
         state2 = choice(self.inner_states)
         if state2 not in self.get_transitions(state1):
+            self._save_state(state1)
             self.transitions[state1].append(state2)
             return True
         else:
@@ -168,6 +235,7 @@ class HMM:
             return False
         else:
             state2 = choice(self.get_transitions(state1))
+            self._save_state(state1)
             self.transitions[state1].remove(state2)
             return True
 
@@ -177,6 +245,7 @@ class HMM:
         feature_table = get_feature_table()
         segment = feature_table.get_random_segment()
         if segment not in self.get_emissions(state):
+            self._save_state(state)
             self.emissions[state].append(segment)
             return True
         else:
@@ -188,6 +257,7 @@ class HMM:
         emissions = self.get_emissions(state)
         if emissions:
             emission = choice(emissions)
+            self._save_state(state)
             self.emissions[state].remove(emission)
             return True
         else:
@@ -205,6 +275,7 @@ class HMM:
             insertion_index = randint(0, len(original_emission))
             new_emission = original_emission[:insertion_index] + segment_to_insert + original_emission[insertion_index:]
             if new_emission not in self.get_emissions(state):
+                self._save_state(state)
                 self.emissions[state].append(new_emission)
                 return True
         return False
@@ -221,6 +292,7 @@ class HMM:
                 deletion_index = randint(0, len(emission) - 1)
                 new_emission = emission[:deletion_index] + emission[deletion_index + 1:]
                 if new_emission not in self.get_emissions(state):
+                    self._save_state(state)
                     self.emissions[state].append(new_emission)
 
             return True
@@ -244,7 +316,8 @@ class HMM:
             new_emission = ''.join(emission_string_list)
 
             # replace emission
-            emissions.append(new_emission)
+            self._save_state(state)
+            self.emissions[state].append(new_emission)
             return True
         else:
             return False
@@ -310,6 +383,17 @@ class HMM:
         """used in get_encoding_length"""
         return self.transitions.get(state, [])
 
+    def get_changed_states(self, other_hmm):
+        """the states whose transitions or emissions differ in other_hmm.
+        a path of the nfa that avoids them is a path of the other nfa too, with the same outgoing arcs on every state"""
+        states = set(self.get_states()) | set(other_hmm.get_states())
+        return {state for state in states if self.get_transitions(state) != other_hmm.get_transitions(state) or
+                self.get_emissions(state) != other_hmm.get_emissions(state)}
+
+    def get_prefix_tree(self, max_length):
+        """the root of the prefix tree of the words of the nfa up to max_length (see NFAPrefixNode)"""
+        return NFAPrefixNode(self.nfa, frozenset(self.nfa.epsilonClosure(set(self.nfa.Initial))), "", max_length)
+
     def get_string_words_up_to_length(self, max_length):
         string_words = self.nfa.enumNFA(max_length)
         string_words.remove("")
@@ -442,3 +526,31 @@ class HMM:
         print("}", file=str_io, end="")
 
         return str_io.getvalue()
+
+
+class NFAPrefixNode:
+    """a node of the prefix tree of the words of an nfa up to a maximal length: the subset construction of the nfa,
+    unfolded into a tree. the children of a node are made when they are asked for, so a walk that skips a
+    subtree does not enumerate its words"""
+    __slots__ = ["nfa", "states", "prefix", "max_length"]
+
+    def __init__(self, nfa, states, prefix, max_length):
+        self.nfa = nfa
+        self.states = states  # the epsilon closed set of nfa states that prefix leads to
+        self.prefix = prefix
+        self.max_length = max_length
+
+    def get_children(self):
+        if len(self.prefix) == self.max_length:
+            return []
+        targets_by_symbol = dict()
+        for state in self.states:
+            for symbol, targets in self.nfa.delta.get(state, {}).items():
+                if symbol != Epsilon:
+                    targets_by_symbol.setdefault(symbol, set()).update(targets)
+        return [(symbol, NFAPrefixNode(self.nfa, frozenset(self.nfa.epsilonClosure(targets)), self.prefix + symbol,
+                                       self.max_length))
+                for symbol, targets in targets_by_symbol.items()]
+
+    def ends_word(self):
+        return bool(self.prefix) and not self.nfa.Final.isdisjoint(self.states)
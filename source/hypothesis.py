@@ -1,20 +1,45 @@
 import logging
 import pickle
-
-
+from collections import namedtuple
 
 from parser import ParsingNFA
+from hmm import get_hmm_state
+from word import Word
+from corpus import Corpus, CorpusIndex
 from utils import get_configuration, get_feature_table, ceiling_of_log_two
-from typing import Dict, Set, Tuple
+from typing import Dict, Set, Tuple, FrozenSet
 
 logger = logging.getLogger(__name__)
 
+_missing = object()
+
+# what the incremental evaluation of a neighbor needs of the hypothesis it was made from
+ParentEvaluation = namedtuple('ParentEvaluation', ['data_parse_dict', 'encoding_length_by_underlying_form',
+                                                   'hmm_states_by_underlying_form', 'lexicon_words',
+                                                   'constraint_set_key', 'changed_hmm_states'])
+
+# the evaluation of a hypothesis, restored when an undoable mutation is undone
+HypothesisUndoRecord = namedtuple('HypothesisUndoRecord', ['grammar_undo_record', 'data_parse_dict',
+                                                           'encoding_length_by_underlying_form',
+                                                           'hmm_states_by_underlying_form', 'grammar_energy',
+                                                           'data_energy', 'combined_energy'])
+
+# the results of get_energy, e.g. for sending an evaluation back from another process
+HypothesisEvaluationState = namedtuple('HypothesisEvaluationState', ['data_parse_dict',
+                                                                     'encoding_length_by_underlying_form',
+                                                                     'hmm_states_by_underlying_form', 'grammar_energy',
+                                                                     'data_energy', 'combined_energy'])
+
 
 class Hypothesis:
     def __init__(self, grammar, data):
         self.grammar = grammar
-        self.data = data
+        self.data = data  # a Corpus, or a list of words in which a word is repeated by its multiplicity
+        self.corpus_index: CorpusIndex = None  # made when first needed, and shared with the neighbors
         self.data_parse_dict = None
+        self.encoding_length_by_underlying_form: Dict[str, int] = None
+        self.hmm_states_by_underlying_form: Dict[str, FrozenSet[str]] = None  # the HMM states of the parses
+        self.parent_evaluation: ParentEvaluation = None  # kept until the energy is computed
         self.grammar_energy = None
         self.data_energy = None
         self.combined_energy = None
@@ -32,31 +57,75 @@ class Hypothesis:
     def get_data_length_given_grammar(self):
         """data_parse_dict is a dictionary with:
             keys: words of the data;
-            values: sets of parses of a word [parse = a pair (underlying_form, number_of_surface_forms)]"""
+            values: sets of parses of a word [parse = a pair (underlying_form, number_of_surface_forms)]
 
-        data_parse_dict: Dict[str, Set[Tuple[str, int]]] = self.parse_data()
-        for surface_form in self.data:
+        a mutated hypothesis is evaluated incrementally from its parent evaluation: after a lexicon mutation the
+        parses of the words that stay in the lexicon are kept (see _parse_data_given_parent), and the encoding lengths
+        of the underlying forms are kept for what the mutation did not change in the HMM (see
+        _update_encoding_lengths)"""
+        parent, self.parent_evaluation = self.parent_evaluation, None
+
+        if parent and parent.lexicon_words is not None and \
+                parent.constraint_set_key == str(self.grammar.constraint_set):
+            data_parse_dict: Dict[str, Set[Tuple[str, int]]] = self._parse_data_given_parent(parent)
+        else:
+            data_parse_dict: Dict[str, Set[Tuple[str, int]]] = self.parse_data()
+        corpus_index = self.get_corpus_index()
+        for surface_form in corpus_index.get_distinct_words():
             if not data_parse_dict[surface_form]:  # if data_parse_dict[word] is the empty set
                 return float("inf")
 
         self.data_parse_dict = data_parse_dict
-
-        fado_nfa = self.grammar.lexicon.hmm.nfa
-        parsing_nfa = ParsingNFA.get_from_fado_nfa(fado_nfa)
+        self._update_encoding_lengths(parent)
 
         encoding_length = 0
-        for target_surface_form in self.data:
+        for target_surface_form, multiplicity in corpus_index.get_multiplicities():  # every distinct word once
             combined_choice_encoding_lengths_list = []
             for underlying_form_tuple in data_parse_dict[target_surface_form]:
                 underlying_form, number_of_surface_forms_derived_from_underlying_form = underlying_form_tuple
-                underlying_form_choice_encoding_length = parsing_nfa.get_observation_encoding_length(str(underlying_form))
+                underlying_form_choice_encoding_length = self.encoding_length_by_underlying_form[str(underlying_form)]
                 surface_form_choice_encoding_length = ceiling_of_log_two(number_of_surface_forms_derived_from_underlying_form)
                 combined_choice_encoding_length = underlying_form_choice_encoding_length + surface_form_choice_encoding_length
                 combined_choice_encoding_lengths_list.append(combined_choice_encoding_length)
             minimal_combined_choice_encoding_length = min(combined_choice_encoding_lengths_list)
-            encoding_length += minimal_combined_choice_encoding_length
+            encoding_length += multiplicity * minimal_combined_choice_encoding_length
         return encoding_length
 
+    def _update_encoding_lengths(self, parent):
+        """sets the encoding lengths of the underlying forms in data_parse_dict.
+        if the HMM is the parent's (a constraint set mutation), all the lengths of the parent are kept - including
+        those of underlying forms that are not in the current parses, so they survive a sequence of such mutations.
+        otherwise an underlying form keeps the length it had in the parent unless its parse there, or some path for it
+        in the new HMM, goes through a state that the mutation changed. every path through a changed inner state
+        emits one of its emissions, and every parse goes through the initial state"""
+        underlying_forms = {str(underlying_form) for parses in self.data_parse_dict.values()
+                            for underlying_form, _ in parses}
+        hmm = self.grammar.lexicon.hmm
+        self.encoding_length_by_underlying_form = dict()
+        self.hmm_states_by_underlying_form = dict()
+
+        changed_states = parent.changed_hmm_states if parent else None
+        if parent and not changed_states:
+            self.encoding_length_by_underlying_form.update(parent.encoding_length_by_underlying_form)
+            self.hmm_states_by_underlying_form.update(parent.hmm_states_by_underlying_form)
+        elif parent:
+            changed_states_emissions = [emission for state in changed_states for emission in hmm.get_emissions(state)]
+            for underlying_form in underlying_forms:
+                if underlying_form in parent.encoding_length_by_underlying_form and \
+                        parent.hmm_states_by_underlying_form[underlying_form].isdisjoint(changed_states) and \
+                        not any(emission in underlying_form for emission in changed_states_emissions):
+                    self.encoding_length_by_underlying_form[underlying_form] = \
+                        parent.encoding_length_by_underlying_form[underlying_form]
+                    self.hmm_states_by_underlying_form[underlying_form] = \
+                        parent.hmm_states_by_underlying_form[underlying_form]
+
+        unparsed_underlying_forms = underlying_forms - self.encoding_length_by_underlying_form.keys()
+        if unparsed_underlying_forms:
+            parsing_nfa = ParsingNFA.get_from_fado_nfa(hmm.nfa)
+            for underlying_form, parse in parsing_nfa.parse_all(unparsed_underlying_forms).items():
+                self.encoding_length_by_underlying_form[underlying_form] = parsing_nfa.get_parse_encoding_length(parse)
+                self.hmm_states_by_underlying_form[underlying_form] = frozenset(map(get_hmm_state, parse[0]))
+
     def get_recent_data_parse(self):
         result = ""
         data_parse_with_string_keys = dict()
@@ -97,28 +166,144 @@ class Hypothesis:
         The number of outputs an input can generate is later used to calculate the probability of a word under
         the grammar.
         """
-        data_parse_dict = {word: set() for word in self.data}
+        data_parse_dict = {word: set() for word in self.get_corpus_index().get_distinct_words()}
+        if _is_generating_from_lexicon_automaton():
+            self._add_parses_from_lexicon_automaton(data_parse_dict)
+        else:
+            lexicon_word_set = set(self.grammar.lexicon.get_words())
+            self._add_parses(data_parse_dict, lexicon_word_set)
+        return data_parse_dict
+
+    def _add_parses_from_lexicon_automaton(self, data_parse_dict):
+        """_add_parses for all the lexicon words, generated from the lexicon HMM (see Grammar.generate_lexicon)
+        without enumerating them - a Word is made only for an underlying form of some surface form in the data"""
+        if _is_pruning_generation_to_data():
+            data_outputs_by_underlying_form = self.grammar.generate_lexicon(self.get_corpus_index())
+            self._add_data_parses(data_parse_dict, {Word(underlying_form): data_outputs for underlying_form, data_outputs
+                                                    in data_outputs_by_underlying_form.items()})
+            return
+        for underlying_form, outputs in self.grammar.generate_lexicon().items():
+            data_outputs = [output for output in outputs if output in data_parse_dict]
+            if data_outputs:
+                parse = (Word(underlying_form), len(outputs))
+                for output in data_outputs:
+                    data_parse_dict[output].add(parse)
+
+    def _parse_data_given_parent(self, parent):
+        """parse_data for a lexicon mutation of parent - the grammar is the parent's, so the parses of the words that
+        are in both lexicons stay, and only the words added to or removed from the lexicon are generated"""
+        parent_lexicon_word_set = set(parent.lexicon_words)
         lexicon_word_set = set(self.grammar.lexicon.get_words())
+        data_parse_dict = {word: set(parses) for word, parses in parent.data_parse_dict.items()}
 
+        for removed_word in parent_lexicon_word_set - lexicon_word_set:
+            outputs = self.grammar.generate(removed_word)
+            for output in outputs:
+                if output in data_parse_dict:
+                    data_parse_dict[output].discard((removed_word, len(outputs)))
+
+        self._add_parses(data_parse_dict, lexicon_word_set - parent_lexicon_word_set)
+        return data_parse_dict
 
-        for word_in_lexicon in lexicon_word_set:
-            outputs = self.grammar.generate(word_in_lexicon)  # outputs in a list of Words
+    def _add_parses(self, data_parse_dict, lexicon_words):
+        if _is_pruning_generation_to_data():
+            self._add_data_parses(data_parse_dict,
+                                  self.grammar.get_data_outputs_of_words(lexicon_words, self.get_corpus_index()))
+            return
+        outputs_by_word = self.grammar.generate_all(lexicon_words)
+        for word_in_lexicon in lexicon_words:
+            outputs = outputs_by_word[word_in_lexicon]  # outputs in a list of Words
             number_of_outputs = len(outputs)
             for output in outputs:
-                if output in self.data:
+                if output in data_parse_dict:
                     parse = (word_in_lexicon, number_of_outputs)
                     data_parse_dict[output].add(parse)
-        # print(data_parse_dict)
-        return data_parse_dict
+
+    def _add_data_parses(self, data_parse_dict, data_outputs_by_word):
+        """adds the parses of the words with outputs in the data (see Grammar.get_data_outputs_of_words). the number of
+        outputs of a parse counts all the outputs of the word, so only those words are fully generated"""
+        outputs_by_word = self.grammar.generate_all(data_outputs_by_word)
+        for word, data_outputs in data_outputs_by_word.items():
+            parse = (word, len(outputs_by_word[word]))
+            for output in data_outputs:
+                data_parse_dict[output].add(parse)
+
+    def get_corpus_index(self):
+        if self.corpus_index is None:
+            if isinstance(self.data, Corpus):
+                self.corpus_index = self.data.get_index()
+            else:
+                self.corpus_index = CorpusIndex.from_words(self.data)
+        return self.corpus_index
 
     def get_neighbor(self):
-        new_hypothesis = self.get_hypothesis_copy()
-        mutation_result = new_hypothesis.grammar.make_mutation()
+        mutation_result, neighbor_grammar = self.grammar.get_neighbor()
+        new_hypothesis = Hypothesis(neighbor_grammar, self.data)
+        new_hypothesis.corpus_index = self.corpus_index
+        new_hypothesis.parent_evaluation = self._get_evaluation(
+            neighbor_grammar.lexicon.hmm.get_changed_states(self.grammar.lexicon.hmm))
         return mutation_result, new_hypothesis
 
+    def make_undoable_mutation(self):
+        """mutates the grammar in place (see Grammar.make_undoable_mutation), returning the mutation result and
+        a HypothesisUndoRecord for undo_mutation. the next get_energy is incremental, as for a neighbor"""
+        lexicon_words = None if _is_generating_from_lexicon_automaton() else self.grammar.lexicon.get_words()
+        constraint_set_key = str(self.grammar.constraint_set)
+        mutation_result, grammar_undo_record = self.grammar.make_undoable_mutation()
+        undo_record = HypothesisUndoRecord(grammar_undo_record, self.data_parse_dict,
+                                           self.encoding_length_by_underlying_form,
+                                           self.hmm_states_by_underlying_form,
+                                           self.grammar_energy, self.data_energy, self.combined_energy)
+        if grammar_undo_record.mutated_object is self.grammar.lexicon:
+            changed_hmm_states = grammar_undo_record.undo_record.hmm_undo_record.get_changed_states()
+        else:
+            changed_hmm_states = set()
+        self.parent_evaluation = self._get_evaluation(changed_hmm_states, constraint_set_key, lexicon_words)
+        return mutation_result, undo_record
+
+    def undo_mutation(self, undo_record):
+        """restores the grammar and the evaluation from before make_undoable_mutation"""
+        self.grammar.undo_mutation(undo_record.grammar_undo_record)
+        self.data_parse_dict = undo_record.data_parse_dict
+        self.encoding_length_by_underlying_form = undo_record.encoding_length_by_underlying_form
+        self.hmm_states_by_underlying_form = undo_record.hmm_states_by_underlying_form
+        self.grammar_energy = undo_record.grammar_energy
+        self.data_energy = undo_record.data_energy
+        self.combined_energy = undo_record.combined_energy
+        self.parent_evaluation = None
+
+    def get_evaluation_state(self):
+        return HypothesisEvaluationState(self.data_parse_dict, self.encoding_length_by_underlying_form,
+                                         self.hmm_states_by_underlying_form, self.grammar_energy, self.data_energy,
+                                         self.combined_energy)
+
+    def set_evaluation_state(self, evaluation_state):
+        """sets the results of get_energy of an equal hypothesis (e.g. a copy evaluated in another process)"""
+        self.data_parse_dict = evaluation_state.data_parse_dict
+        self.encoding_length_by_underlying_form = evaluation_state.encoding_length_by_underlying_form
+        self.hmm_states_by_underlying_form = evaluation_state.hmm_states_by_underlying_form
+        self.grammar_energy = evaluation_state.grammar_energy
+        self.data_energy = evaluation_state.data_energy
+        self.combined_energy = evaluation_state.combined_energy
+        self.parent_evaluation = None
+
+    def _get_evaluation(self, changed_hmm_states, constraint_set_key=None, lexicon_words=_missing):
+        """the ParentEvaluation of this hypothesis for a mutation of it, or None if its energy was not computed.
+        the lexicon words are not kept when generating from the lexicon automaton (and a lexicon mutation is then
+        evaluated without the parses of the parent)"""
+        if self.data_parse_dict is None:
+            return None
+        if lexicon_words is _missing:
+            lexicon_words = None if _is_generating_from_lexicon_automaton() else self.grammar.lexicon.get_words()
+        return ParentEvaluation(self.data_parse_dict, self.encoding_length_by_underlying_form,
+                                self.hmm_states_by_underlying_form, lexicon_words,
+                                constraint_set_key or str(self.grammar.constraint_set), changed_hmm_states)
+
     def get_hypothesis_copy(self):
         grammar_copy = pickle.loads(pickle.dumps(self.grammar, -1))
-        return Hypothesis(grammar_copy, self.data)
+        hypothesis_copy = Hypothesis(grammar_copy, self.data)
+        hypothesis_copy.corpus_index = self.corpus_index
+        return hypothesis_copy
 
     def __str__(self):
         return "Hypothesis with energy: {0}".format(self.get_energy())
@@ -126,3 +311,10 @@ class Hypothesis:
     def __repr__(self):
         return self.__str__()
 
+
+def _is_generating_from_lexicon_automaton():
+    return get_configuration("GENERATE_FROM_LEXICON_AUTOMATON")
+
+
+def _is_pruning_generation_to_data():
+    return get_configuration("PRUNE_GENERATION_TO_DATA")
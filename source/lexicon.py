@@ -1,4 +1,6 @@
 import logging
+from collections import namedtuple
+from copy import copy
 from math import log, ceil
 from random import choice, randint
 
@@ -8,6 +10,8 @@ from hmm import HMM
 
 logger = logging.getLogger(__name__)
 
+LexiconUndoRecord = namedtuple('LexiconUndoRecord', ['words', 'hmm_undo_record'])
+
 
 class Lexicon:
     def __init__(self, string_input_words, max_word_length_in_data, initial_hmm=None, alphabet_or_words="words"):
@@ -25,32 +29,51 @@ class Lexicon:
         else:
             self.hmm = initial_hmm
 
-        self.words = []
-        self._update_words()
+        self.words = None  # enumerated from the HMM when first asked for, see get_words
 
     def make_mutation(self):
         mutation_result = self.hmm.make_mutation()
         if mutation_result:
-            self._update_words()
+            self.words = None
         return mutation_result
 
+    def make_undoable_mutation(self):
+        """make_mutation in place, returning the mutation result and a LexiconUndoRecord for undo_mutation"""
+        words = self.words
+        mutation_result, hmm_undo_record = self.hmm.make_undoable_mutation()
+        if mutation_result:
+            self.words = None
+        return mutation_result, LexiconUndoRecord(words, hmm_undo_record)
+
+    def undo_mutation(self, undo_record):
+        self.hmm.undo_mutation(undo_record.hmm_undo_record)
+        self.words = undo_record.words
+
+    def get_copy(self):
+        """a copy to mutate - the HMM is copied, the words are shared until a mutation replaces them"""
+        lexicon_copy = copy(self)
+        lexicon_copy.hmm = self.hmm.get_copy()
+        return lexicon_copy
+
     def get_encoding_length(self):
         hmm_encoding_length = self.hmm.get_encoding_length()
         return hmm_encoding_length
 
     def get_distinct_segments(self):
         distinct_segments = set()
-        for word in self.words:
+        for word in self.get_words():
             distinct_segments = distinct_segments | set(word.get_segments())
         return distinct_segments
 
     def get_number_of_distinct_words(self):
-        return len(set(self.words))
+        return len(set(self.get_words()))
 
     def _get_number_of_segments(self):
-        return sum([len(word) for word in self.words])
+        return sum([len(word) for word in self.get_words()])
 
     def get_words(self):
+        if self.words is None:
+            self._update_words()
         return self.words
 
     def _update_words(self):
@@ -59,14 +82,14 @@ class Lexicon:
         self.words = updated_words
 
     def __str__(self):
-            return "Lexicon, number of words: {0}, number of segments: {1}".format(len(self.words),
+            return "Lexicon, number of words: {0}, number of segments: {1}".format(len(self.get_words()),
                                                                          self._get_number_of_segments())
 
     def __repr__(self):
         return self.__str__()
 
     def __getitem__(self, item):
-        return self.words[item].get_segments()
+        return self.get_words()[item].get_segments()
 
     def __len__(self):
-        return len(self.words)
+        return len(self.get_words())
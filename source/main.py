@@ -10,7 +10,8 @@ from corpus import Corpus
 from grammar import Grammar
 from hypothesis import Hypothesis
 from simulated_annealing import SimulatedAnnealing
-from utils import set_configuration
+from parallel_tempering import ParallelTempering
+from utils import get_configuration, set_configuration
 
 
 if __name__ == '__main__':
@@ -37,6 +38,7 @@ if __name__ == '__main__':
 
     feature_tables_dir_path = join(dir_name, "tests/fixtures/feature_tables")
     constraint_sets_dir_path = join(dir_name, "tests/fixtures/constraint_sets")
+    corpora_dir_path = join(dir_name, "tests/fixtures/corpora")
 
     feature_table_file_path = join(feature_tables_dir_path, current_simulation.feature_table_file_name)
     feature_table = FeatureTable.load(feature_table_file_path)
@@ -44,19 +46,26 @@ if __name__ == '__main__':
     constraint_set_file_path = join(constraint_sets_dir_path, current_simulation.constraint_set_file_name)
     constraint_set = ConstraintSet.load(constraint_set_file_path)
 
-    corpus = Corpus(current_simulation.corpus)
+    if hasattr(current_simulation, "corpus_file_name"):
+        corpus = Corpus.load(join(corpora_dir_path, current_simulation.corpus_file_name))
+    else:
+        corpus = Corpus(current_simulation.corpus)
 
     data = corpus.get_words()
-    max_word_length_in_data = max([len(word) for word in data])
+    max_word_length_in_data = corpus.get_max_word_length()
     lexicon = Lexicon(data, max_word_length_in_data)
 
     grammar = Grammar(constraint_set, lexicon)
-    hypothesis = Hypothesis(grammar, data)
+    hypothesis = Hypothesis(grammar, corpus)  # the energy evaluates every distinct word of the corpus once
 
     if hasattr(current_simulation, "target_energy"):
         target_energy = current_simulation.target_energy
     else:
         target_energy = None
 
-    simulated_annealing = SimulatedAnnealing(hypothesis, target_energy)
-    simulated_annealing.run()
+    if get_configuration("NUMBER_OF_CHAINS") > 1:
+        parallel_tempering = ParallelTempering(hypothesis, target_energy)
+        parallel_tempering.run()
+    else:
+        simulated_annealing = SimulatedAnnealing(hypothesis, target_energy)
+        simulated_annealing.run()
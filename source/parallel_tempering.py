@@ -0,0 +1,209 @@
+"""
+multi chain simulated annealing (parallel tempering).
+
+NUMBER_OF_CHAINS chains run in forked processes, each at its own rung of a temperature ladder: the chain at rank k
+runs at the annealing temperature times TEMPERATURE_LADDER_RATIO ** k, and the whole ladder cools with
+COOLING_PARAMETER as in SimulatedAnnealing. every REPLICA_SWAP_INTERVAL steps the chains report their energies and
+swaps of the temperatures of adjacent ranks are proposed, so a good hypothesis found by a hot chain can move down the
+ladder.
+
+the chains are forked after the first hypothesis is evaluated, so the feature table, the corpus, the configurations
+and the transducer caches are shared (copy on write) instead of being loaded by every chain. with
+TRANSDUCERS_DISK_CACHE_DIRECTORY the chains also share the transducers that they build.
+"""
+import logging
+import multiprocessing
+import pickle
+import random
+import time
+from math import exp
+
+from hypothesis import Hypothesis
+from simulated_annealing import SimulatedAnnealing, _pretty_runtime_str
+from utils import get_configuration
+
+logger = logging.getLogger(__name__)
+
+
+class ChainStatistics:
+    def __init__(self, chain_index):
+        self.chain_index = chain_index
+        self.number_of_steps = 0
+        self.number_of_accepted_mutations = 0
+        self.number_of_swap_attempts = 0
+        self.number_of_swaps = 0
+        self.energy = None
+        self.best_energy = None
+        self.temperature = None
+
+    def __str__(self):
+        acceptance_rate = self.number_of_accepted_mutations / self.number_of_steps if self.number_of_steps else 0
+        swap_rate = self.number_of_swaps / self.number_of_swap_attempts if self.number_of_swap_attempts else 0
+        return "chain {}: {:,} steps, {:.1%} accepted, {:,} of {:,} swaps ({:.1%}), temperature {:.4g}, " \
+               "energy {:,}, best energy {:,}".format(self.chain_index, self.number_of_steps, acceptance_rate,
+                                                      self.number_of_swaps, self.number_of_swap_attempts, swap_rate,
+                                                      self.temperature, self.energy, self.best_energy)
+
+
+class ParallelTempering:
+    def __init__(self, traversable_hypothesis, target_energy):
+        self.initial_hypothesis = traversable_hypothesis
+        self.target_energy = target_energy
+        self.chain_statistics = None
+        self.connections = None
+        self.processes = None
+        self.rank_by_chain = None  # the rung of the temperature ladder that each chain is at
+        self.swap_random = None
+
+    def run(self):
+        """runs the chains until the annealing temperature reaches THRESHOLD (or STEPS_LIMITATION steps), and returns
+        the hypothesis with the lowest energy found by any chain and the statistics of the chains"""
+        start_time = time.time()
+        number_of_chains = get_configuration("NUMBER_OF_CHAINS")
+        seed = get_configuration("SEED")
+        initial_energy = self.initial_hypothesis.get_energy()
+        if initial_energy == float("INF"):
+            raise ValueError("first hypothesis energy can not be INF")
+
+        self._start_chains(number_of_chains, seed)
+        self.swap_random = random.Random(seed)
+        self.rank_by_chain = list(range(number_of_chains))
+        self.chain_statistics = [ChainStatistics(chain_index) for chain_index in range(number_of_chains)]
+
+        step_limitation = get_configuration("STEPS_LIMITATION")
+        if step_limitation != float("inf"):
+            number_of_expected_steps = step_limitation
+        else:
+            number_of_expected_steps = SimulatedAnnealing._calculate_num_of_steps()
+        logger.info("Running {} chains, number of expected steps is: {:,}".format(number_of_chains,
+                                                                                 number_of_expected_steps))
+
+        try:
+            step = 0
+            swap_interval = get_configuration("REPLICA_SWAP_INTERVAL")
+            while step < number_of_expected_steps:
+                number_of_steps = min(swap_interval, number_of_expected_steps - step)
+                self._run_chains(step, number_of_steps)
+                step += number_of_steps
+                self._propose_swaps(step, step // swap_interval)
+                if not step % get_configuration("DEBUG_LOGGING_INTERVAL") or step == number_of_expected_steps:
+                    self._log_chains_state(step, number_of_expected_steps)
+            best_hypothesis = self._get_best_hypothesis()
+        finally:
+            self._stop_chains()
+
+        logger.info("*" * 10 + " Final Hypothesis " + "*" * 10)
+        logger.info("Grammar with: {}:".format(best_hypothesis.grammar.constraint_set))
+        logger.info("{}".format(best_hypothesis.grammar.lexicon))
+        logger.info(best_hypothesis.get_recent_energy_signature())
+        logger.info("parallel tempering runtime was: {}".format(_pretty_runtime_str(time.time() - start_time)))
+        return best_hypothesis, self.chain_statistics
+
+    def _get_temperature(self, chain_index, step):
+        annealing_temperature = get_configuration("INITIAL_TEMPERATURE") * get_configuration("COOLING_PARAMETER") ** step
+        return annealing_temperature * get_configuration("TEMPERATURE_LADDER_RATIO") ** self.rank_by_chain[chain_index]
+
+    def _start_chains(self, number_of_chains, seed):
+        context = multiprocessing.get_context("fork")
+        self.connections = list()
+        self.processes = list()
+        for chain_index in range(number_of_chains):
+            connection, chain_connection = context.Pipe()
+            process = context.Process(target=_run_chain, daemon=True,
+                                      args=(chain_connection, self.initial_hypothesis, self.target_energy,
+                                            seed + chain_index + 1))
+            process.start()
+            chain_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def _stop_chains(self):
+        for connection in self.connections:
+            try:
+                connection.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+
+    def _run_chains(self, step, number_of_steps):
+        for chain_index, connection in enumerate(self.connections):
+            connection.send(("run", self._get_temperature(chain_index, step), number_of_steps))
+        for statistics, connection in zip(self.chain_statistics, self.connections):
+            energy, best_energy, number_of_accepted_mutations = connection.recv()
+            statistics.number_of_steps += number_of_steps
+            statistics.number_of_accepted_mutations += number_of_accepted_mutations
+            statistics.energy = energy
+            statistics.best_energy = best_energy
+
+    def _propose_swaps(self, step, swap_round):
+        """proposes swaps of adjacent ranks, alternating between the even and the odd pairs. the swap of a colder
+        chain i and a hotter chain j is accepted with probability min(1, exp((1/T_i - 1/T_j) * (E_i - E_j)))"""
+        chain_by_rank = sorted(range(len(self.rank_by_chain)), key=lambda chain_index: self.rank_by_chain[chain_index])
+        for rank in range(swap_round % 2, len(chain_by_rank) - 1, 2):
+            colder_chain, hotter_chain = chain_by_rank[rank], chain_by_rank[rank + 1]
+            colder_statistics = self.chain_statistics[colder_chain]
+            hotter_statistics = self.chain_statistics[hotter_chain]
+            inverse_temperatures_delta = 1 / self._get_temperature(colder_chain, step) - \
+                1 / self._get_temperature(hotter_chain, step)
+            exponent = inverse_temperatures_delta * (colder_statistics.energy - hotter_statistics.energy)
+            swapping_probability = 1 if exponent >= 0 else exp(exponent)
+            colder_statistics.number_of_swap_attempts += 1
+            hotter_statistics.number_of_swap_attempts += 1
+            if self.swap_random.random() < swapping_probability:
+                self.rank_by_chain[colder_chain], self.rank_by_chain[hotter_chain] = rank + 1, rank
+                colder_statistics.number_of_swaps += 1
+                hotter_statistics.number_of_swaps += 1
+        for chain_index, statistics in enumerate(self.chain_statistics):
+            statistics.temperature = self._get_temperature(chain_index, step)
+
+    def _get_best_hypothesis(self):
+        best_energy, best_grammar = float("inf"), None
+        for connection in self.connections:
+            connection.send(("get_best",))
+            energy, pickled_grammar = connection.recv()
+            if best_grammar is None or energy < best_energy:
+                best_energy, best_grammar = energy, pickled_grammar
+        best_hypothesis = Hypothesis(pickle.loads(best_grammar), self.initial_hypothesis.data)
+        best_hypothesis.get_energy()
+        return best_hypothesis
+
+    def _log_chains_state(self, step, number_of_expected_steps):
+        logger.info("\n" + "-" * 125)
+        logger.info("Step {:,} of {:,}".format(step, number_of_expected_steps))
+        for statistics in self.chain_statistics:
+            logger.info(statistics)
+        best_energy = min(statistics.best_energy for statistics in self.chain_statistics)
+        if self.target_energy is not None:
+            logger.info("Distance from target energy: {}".format(best_energy - self.target_energy))
+
+
+def _run_chain(connection, hypothesis, target_energy, seed):
+    """the loop of a chain process: runs annealing steps at the temperatures it is sent and keeps (pickled) the
+    grammar with the lowest energy it reached"""
+    random.seed(seed)
+    simulated_annealing = SimulatedAnnealing(hypothesis, target_energy)
+    simulated_annealing.cooling_parameter = get_configuration("COOLING_PARAMETER")
+    simulated_annealing.current_hypothesis_energy = hypothesis.get_energy()
+    best_energy = simulated_annealing.current_hypothesis_energy
+    best_grammar = pickle.dumps(hypothesis.grammar, -1)
+    while True:
+        command = connection.recv()
+        if command[0] == "run":
+            _, simulated_annealing.current_temperature, number_of_steps = command
+            number_of_accepted_mutations = 0
+            for _ in range(number_of_steps):
+                simulated_annealing.step += 1
+                simulated_annealing.current_temperature *= simulated_annealing.cooling_parameter
+                if simulated_annealing._make_annealing_step():
+                    number_of_accepted_mutations += 1
+                    if simulated_annealing.current_hypothesis_energy < best_energy:
+                        best_energy = simulated_annealing.current_hypothesis_energy
+                        best_grammar = pickle.dumps(simulated_annealing.current_hypothesis.grammar, -1)
+            connection.send((simulated_annealing.current_hypothesis_energy, best_energy, number_of_accepted_mutations))
+        elif command[0] == "get_best":
+            connection.send((best_energy, best_grammar))
+        else:
+            connection.close()
+            return
@@ -1,5 +1,5 @@
+import heapq
 from math import log
-from copy import deepcopy
 from io import StringIO
 from utils import ceiling_of_log_two
 from typing import Dict, Set
@@ -8,15 +8,22 @@ from FAdo.fa import Epsilon as fado_epsilon
 NULL_SEGMENT = "-"
 
 
-class TableCell:
-    def __init__(self, probability, output, state_back_pointer, position_back_pointer):
-        self.probability = probability
-        self.output = output
-        self.state_back_pointer = state_back_pointer
-        self.position_back_pointer = position_back_pointer
+class TableColumn:
+    """the cells of a position of the parsing table. a cell is the log probability of the best path to a state (by
+    state number) and a back pointer to the previous cell of that path - its index in the table, which is
+    position * number of states + state number"""
+    __slots__ = ["position", "probabilities", "back_pointers", "states"]
+
+    def __init__(self, position, number_of_states):
+        self.position = position
+        self.probabilities = [float("-inf")] * number_of_states
+        self.back_pointers = [-1] * number_of_states
+        self.states = list()  # the states that have a cell, in the order that they got it
 
     def __repr__(self):
-        return "{:.2f}, ({}, {})".format(self.probability, self.state_back_pointer, self.position_back_pointer)
+        return "{}: {}".format(self.position, {state: "{:.2f}, {}".format(self.probabilities[state],
+                                                                          self.back_pointers[state])
+                                               for state in self.states})
 
 
 class ParsingNFA:
@@ -28,6 +35,15 @@ class ParsingNFA:
         self.initial_state = None
         self.final_states = None
         self.arcs_dict = None
+        # the parsing form of the nfa, by state number (see _compile)
+        self.states = None
+        self.state_numbers = None
+        self.log_probabilities = None
+        self.transition_lengths = None
+        self.segment_arcs = None
+        self.epsilon_closures = None
+        self.epsilon_closure_paths = None
+        self.parse_by_observation = dict()  # every observation is parsed once by the nfa
 
     @classmethod
     def get_from_fado_nfa(cls, fado_nfa):
@@ -59,89 +75,188 @@ class ParsingNFA:
                     parsing_nfa_arcs_dict[parsing_nfa_origin_state][parsing_nfa_output_symbol].append(parsing_nfa_terminal_state)
 
         parsing_nfa.arcs_dict = parsing_nfa_arcs_dict
+        parsing_nfa._compile(fado_nfa_states)
         return parsing_nfa
 
-    def parse(self, observation):  # used by: hypothesis
-        observation = " " + observation + " "
-        observation_length = len(observation)
-        table = [{} for _ in range(observation_length)]
-
-        # Initialize the first column
-        for segment in self.arcs_dict.get(self.initial_state, []):
-            for state2 in self.arcs_dict[self.initial_state][segment]:
-                probability = self._get_probability(self.initial_state)
-                table_cell = TableCell(log(probability), segment, self.initial_state, 0)
-                if probability:
-                    if segment is NULL_SEGMENT:
-                        table[0][state2] = table_cell
-                    elif segment == observation[1]:
-                        table[1][state2] = table_cell
-
-        # fill out the rest of the table
-        for position in range(1, observation_length):
-            states = deepcopy(table[position - 1])
-            while states:
-                new_states = set()
-                for state1 in states:
-                    if state1 in self.final_states:
-                        continue
-                    for segment in self.arcs_dict.get(state1, []):
-                        for state2 in self.arcs_dict[state1][segment]:
-                            probability = self._get_probability(state1)
-                            if probability:
-                                combined_probability = log(probability) + table[position - 1][state1].probability
-                                table_cell = TableCell(combined_probability, segment, state1, position - 1)
-                                if segment is NULL_SEGMENT:
-                                    if state2 not in table[position - 1]:
-                                        table[position - 1][state2] = table_cell
-                                        new_states.add(state2)
-                                    elif combined_probability > table[position - 1][state2].probability:
-                                        table[position - 1][state2] = table_cell
-                                        new_states.add(state2)
-                                elif segment == observation[position]:
-                                    if state2 not in table[position]:
-                                        table[position][state2] = table_cell
-                                    elif combined_probability > table[position][state2].probability:
-                                        table[position][state2] = table_cell
-                states = new_states
+    def _compile(self, states):
+        """numbers the states, and keeps by state number the log probability of a transition from the state, the
+        length of its encoding, its arcs by segment and its epsilon closure. the final states are not left while
+        parsing, so they have no arcs here"""
+        self.states = list(states)
+        self.state_numbers = {state: state_number for state_number, state in enumerate(self.states)}
+        number_of_states = len(self.states)
+        self.log_probabilities = [0.0] * number_of_states
+        self.transition_lengths = [0] * number_of_states
+        epsilon_arcs = [() for _ in range(number_of_states)]
+        self.segment_arcs = [{} for _ in range(number_of_states)]
+        for state, arcs in self.arcs_dict.items():
+            state_number = self.state_numbers[state]
+            number_of_outgoing_states = self._get_number_of_outgoing_states(state)
+            if not number_of_outgoing_states:
+                continue
+            self.log_probabilities[state_number] = log(1/number_of_outgoing_states)
+            self.transition_lengths[state_number] = ceiling_of_log_two(number_of_outgoing_states)
+            if state in self.final_states:
+                continue
+            for segment, terminal_states in arcs.items():
+                terminal_state_numbers = [self.state_numbers[terminal_state] for terminal_state in terminal_states]
+                if segment is NULL_SEGMENT:
+                    epsilon_arcs[state_number] = terminal_state_numbers
+                else:
+                    self.segment_arcs[state_number][segment] = terminal_state_numbers
+
+        self.epsilon_closures = [() for _ in range(number_of_states)]
+        self.epsilon_closure_paths = [{} for _ in range(number_of_states)]
+        for state_number in range(number_of_states):
+            if epsilon_arcs[state_number]:
+                self._set_epsilon_closure(state_number, epsilon_arcs)
+
+    def _set_epsilon_closure(self, state, epsilon_arcs):
+        """finds the most probable epsilon path from the state to every other state that epsilon arcs reach from it
+        (dijkstra's algorithm - the log probabilities are not positive). the closure of the state is the list of the
+        pairs of a reached state and the log probability of its path, and the intermediate states of the paths are
+        kept for the back pointers"""
+        closure = list()
+        paths = dict()
+        queue = [(-self.log_probabilities[state], arc_index, terminal_state, ())
+                 for arc_index, terminal_state in enumerate(epsilon_arcs[state])]
+        heapq.heapify(queue)
+        number_of_queued_arcs = len(queue)
+        while queue:
+            negative_log_probability, _, reached_state, intermediate_states = heapq.heappop(queue)
+            if reached_state == state or reached_state in paths:
+                continue
+            closure.append((reached_state, -negative_log_probability))
+            paths[reached_state] = intermediate_states
+            path_log_probability = -negative_log_probability + self.log_probabilities[reached_state]
+            for terminal_state in epsilon_arcs[reached_state]:
+                if terminal_state != state and terminal_state not in paths:
+                    heapq.heappush(queue, (-path_log_probability, number_of_queued_arcs, terminal_state,
+                                           intermediate_states + (reached_state,)))
+                    number_of_queued_arcs += 1
+        self.epsilon_closures[state] = closure
+        self.epsilon_closure_paths[state] = paths
 
+    def parse(self, observation):  # used by: hypothesis
+        """the most probable path of the nfa that emits the observation (viterbi), as a pair of the list of its states
+        and the list of the segments that it emits (NULL_SEGMENT for an epsilon arc). None if there is no such path"""
+        if observation not in self.parse_by_observation:
+            self.parse_all([observation])
+        return self.parse_by_observation[observation]
+
+    def parse_all(self, observations):  # used by: hypothesis
+        """the parses of the observations (see parse), by observation. the observations are parsed in sorted order -
+        a depth first walk of their trie - and the table of an observation keeps the columns of the prefix that it
+        shares with the previous one, so the columns of a shared prefix are filled once"""
+        parses = dict()
+        table = [self._get_initial_column()]
+        self._close_column(table[0])
+        table_observation = ""  # the observation that the columns of the table are of
+        for observation in sorted(set(observations)):
+            if observation in self.parse_by_observation:
+                parses[observation] = self.parse_by_observation[observation]
+                continue
+            common_prefix_length = 0
+            for segment1, segment2 in zip(table_observation, observation):
+                if segment1 != segment2:
+                    break
+                common_prefix_length += 1
+            del table[common_prefix_length + 1:]
+            for segment in observation[common_prefix_length:]:
+                table.append(self._get_next_column(table[-1], segment))
+                self._close_column(table[-1])
+            table_observation = observation
+            parses[observation] = self.parse_by_observation[observation] = self._get_parse(table, observation)
+        return parses
+
+    def _get_initial_column(self):
+        column = TableColumn(0, len(self.states))
+        initial_state_number = self.state_numbers[self.initial_state]
+        column.probabilities[initial_state_number] = 0.0
+        column.states.append(initial_state_number)
+        return column
+
+    def _close_column(self, column):
+        """relaxes the epsilon closures of the cells of the column, in a single pass - a closure is the best path from
+        its state to every state it reaches, so the cells that it improves need not be closed again"""
+        epsilon_closures = self.epsilon_closures
+        probabilities = column.probabilities
+        back_pointers = column.back_pointers
+        table_index = column.position * len(self.states)
+        for state1 in list(column.states):
+            for state2, closure_log_probability in epsilon_closures[state1]:
+                probability = probabilities[state1] + closure_log_probability
+                if probability > probabilities[state2]:
+                    if probabilities[state2] == float("-inf"):
+                        column.states.append(state2)
+                    probabilities[state2] = probability
+                    back_pointers[state2] = table_index + state1
+
+    def _get_next_column(self, column, segment):
+        """the column of the next position, with the cells that the arcs of the segment reach from the column"""
+        log_probabilities = self.log_probabilities
+        segment_arcs = self.segment_arcs
+        previous_probabilities = column.probabilities
+        next_column = TableColumn(column.position + 1, len(self.states))
+        probabilities = next_column.probabilities
+        back_pointers = next_column.back_pointers
+        table_index = column.position * len(self.states)
+        for state1 in column.states:
+            terminal_states = segment_arcs[state1].get(segment)
+            if terminal_states is None:
+                continue
+            probability = log_probabilities[state1] + previous_probabilities[state1]
+            for state2 in terminal_states:
+                if probability > probabilities[state2]:
+                    if probabilities[state2] == float("-inf"):
+                        next_column.states.append(state2)
+                    probabilities[state2] = probability
+                    back_pointers[state2] = table_index + state1
+        return next_column
+
+    def _get_parse(self, table, observation):
+        """follows the back pointers from the most probable final state of the last column of the table"""
+        number_of_states = len(self.states)
+        last_column = table[-1]
         optimal_final_state = None
         optimal_probability = float("-inf")
         for final_state in self.final_states:
-            if final_state in table[-2]:
-                probability = table[-2][final_state].probability
-                if probability > optimal_probability:
-                    optimal_final_state = final_state
-                    optimal_probability = probability
+            final_state_number = self.state_numbers[final_state]
+            probability = last_column.probabilities[final_state_number]
+            if probability > optimal_probability:
+                optimal_final_state = final_state_number
+                optimal_probability = probability
 
-        if not optimal_final_state:
+        if optimal_final_state is None:
             return None
 
-        current_state = optimal_final_state
-        current_position = len(table) - 2
-        backward_states_path = [current_state]
+        initial_state_number = self.state_numbers[self.initial_state]
+        current_position, current_state = last_column.position, optimal_final_state
+        backward_states_path = [self.states[current_state]]
         backward_outputs_path = list()
-        while True:
-            current_cell = table[current_position][current_state]
-            current_state = current_cell.state_back_pointer
-            current_position = current_cell.position_back_pointer
-            current_output = current_cell.output
-            backward_states_path.append(current_state)
-            backward_outputs_path.append(current_output)
-            if current_state == self.initial_state:
-                break
+        while current_state != initial_state_number:
+            back_pointer = table[current_position].back_pointers[current_state]
+            previous_position, previous_state = divmod(back_pointer, number_of_states)
+            if previous_position == current_position:  # an epsilon path in the column
+                for intermediate_state in reversed(self.epsilon_closure_paths[previous_state][current_state]):
+                    backward_states_path.append(self.states[intermediate_state])
+                    backward_outputs_path.append(NULL_SEGMENT)
+                backward_outputs_path.append(NULL_SEGMENT)
+            else:
+                backward_outputs_path.append(observation[previous_position])
+            current_state = previous_state
+            current_position = previous_position
+            backward_states_path.append(self.states[current_state])
 
         states_path = list(reversed(backward_states_path))
         outputs_path = list(reversed(backward_outputs_path))
-        #exit(0)
         return states_path, outputs_path
 
     def get_parse_encoding_length(self, parse):
         encoding_length = 0
         states_path = parse[0]
         for state in states_path[:-1]:
-            bits_for_transition = ceiling_of_log_two(self._get_number_of_outgoing_states(state))
-            encoding_length += bits_for_transition
+            encoding_length += self.transition_lengths[self.state_numbers[state]]
         return encoding_length
 
     def get_observation_encoding_length(self, observation):
@@ -149,6 +264,11 @@ class ParsingNFA:
         encoding_length = self.get_parse_encoding_length(parse)
         return encoding_length
 
+    def get_observations_encoding_lengths(self, observations):
+        """the encoding lengths of the observations, by observation (see parse_all)"""
+        return {observation: self.get_parse_encoding_length(parse)
+                for observation, parse in self.parse_all(observations).items()}
+
     def _get_number_of_outgoing_states(self, state):
         states = set()
         for segment in self.arcs_dict[state]:
@@ -156,9 +276,6 @@ class ParsingNFA:
                 states.add(outgoing_state)
         return len(states)
 
-    def _get_probability(self, state):
-        return 1/self._get_number_of_outgoing_states(state)
-
     def draw(self):
         str_io = StringIO()
         print("digraph acceptor {", file=str_io, end="\n")
@@ -59,6 +59,10 @@ class Segment:
     def __hash__(self):
         return self.hash
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.hash = hash(self.symbol)  # a pickled hash is of the hash seed of the pickling process
+
     def __str__(self):
         if hasattr(self, "feature_table"):
             values_string_io = StringIO()
@@ -1,5 +1,6 @@
 import logging
-from math import exp
+import multiprocessing
+from math import exp, log
 from random import choice
 import random
 from datetime import timedelta
@@ -7,12 +8,9 @@ import time
 import re
 from utils import get_configuration, set_configuration
 from os import getpid
-from grammar import Grammar
-from constraint_set import ConstraintSet
-from constraint import Constraint
-from word import Word
 from configuration import Configuration
 from utils import send_to_webhook
+from bounded_cache import get_caches_statistics_lines
 
 logger = logging.getLogger(__name__)
 process_id = getpid()
@@ -34,14 +32,19 @@ class SimulatedAnnealing:
         self.start_time = None
         self.previous_interval_time = None
         self.previous_interval_energy = None
+        self.number_of_neighbors_per_step = None
+        self.neighbors_evaluation_pool = None
 
     def run(self):
-        self._before_loop()
+        try:
+            self._before_loop()
 
-        while (self.current_temperature > self.threshold) and (self.step != self.step_limitation):
-            self._make_step()
+            while (self.current_temperature > self.threshold) and (self.step != self.step_limitation):
+                self._make_step()
 
-        self._after_loop()
+            self._after_loop()
+        finally:
+            self._terminate_neighbors_evaluation_pool()
         return self.step, self.current_hypothesis
 
     def _before_loop(self):
@@ -77,18 +80,31 @@ class SimulatedAnnealing:
         self.current_temperature = get_configuration("INITIAL_TEMPERATURE")
         self.threshold = get_configuration("THRESHOLD")
         self.cooling_parameter = get_configuration("COOLING_PARAMETER")
+        self.number_of_neighbors_per_step = get_configuration("NUMBER_OF_NEIGHBORS_PER_STEP")
+        number_of_processes = get_configuration("NEIGHBORS_EVALUATION_PROCESSES")
+        if self.number_of_neighbors_per_step > 1 and number_of_processes > 1:
+            self.neighbors_evaluation_pool = multiprocessing.get_context("fork").Pool(number_of_processes)
 
     def _make_step(self):
         self.step += 1
         self.current_temperature *= self.cooling_parameter
 
         self._check_for_intervals()
+        if self.number_of_neighbors_per_step > 1:
+            self._make_multiple_try_step()
+        else:
+            self._make_annealing_step()
 
-        mutation_result, neighbor_hypothesis = self.current_hypothesis.get_neighbor()
+    def _make_annealing_step(self):
+        """mutates the current hypothesis and keeps the mutation with the metropolis probability of the current
+        temperature. returns whether the mutation was kept"""
+        # the current hypothesis is mutated in place and the mutation is undone if the step is rejected
+        mutation_result, undo_record = self.current_hypothesis.make_undoable_mutation()
         if not mutation_result:
-            return  # mutation failed - the neighbor hypothesis is the same as current hypothesis
+            self.current_hypothesis.undo_mutation(undo_record)
+            return False  # mutation failed - the neighbor hypothesis is the same as current hypothesis
 
-        self.neighbor_hypothesis = neighbor_hypothesis
+        self.neighbor_hypothesis = self.current_hypothesis
         self.neighbor_hypothesis_energy = self.neighbor_hypothesis.get_energy()
 
         energy_delta = self.neighbor_hypothesis_energy - self.current_hypothesis_energy
@@ -102,22 +118,82 @@ class SimulatedAnnealing:
         is_to_switch_hypothesis = (random_between_0_and_1 < switching_probability)
 
         if is_to_switch_hypothesis:
-            self.current_hypothesis = self.neighbor_hypothesis
             self.current_hypothesis_energy = self.neighbor_hypothesis_energy
+        else:
+            self.current_hypothesis.undo_mutation(undo_record)
+        return is_to_switch_hypothesis
+
+    def _make_multiple_try_step(self):
+        """a multiple-try metropolis step: NUMBER_OF_NEIGHBORS_PER_STEP neighbors are evaluated together (see
+        _get_evaluated_neighbors) and one of them is chosen with probability proportional to exp(-energy / T).
+        the choice is accepted with probability min(1, sum of the neighbors weights / sum of the reference weights),
+        where the reference set is K - 1 neighbors of the chosen one and the current hypothesis.
+        a failed mutation proposes the hypothesis it was made from. returns whether the current hypothesis changed"""
+        neighbors = self._get_evaluated_neighbors(self.current_hypothesis, self.number_of_neighbors_per_step)
+        neighbors_log_weights = [-neighbor.combined_energy / self.current_temperature for neighbor in neighbors]
+        if max(neighbors_log_weights) == float("-inf"):
+            return False
+
+        chosen_neighbor = neighbors[_choose_index_by_log_weight(neighbors_log_weights)]
+        if chosen_neighbor is self.current_hypothesis:
+            return False
+
+        references = self._get_evaluated_neighbors(chosen_neighbor, self.number_of_neighbors_per_step - 1)
+        references.append(self.current_hypothesis)
+        references_log_weights = [-reference.combined_energy / self.current_temperature for reference in references]
+        log_switching_probability = min(0, _log_sum_exp(neighbors_log_weights) - _log_sum_exp(references_log_weights))
+
+        random_between_0_and_1 = random.random()
+        if random_between_0_and_1 < exp(log_switching_probability):
+            self.neighbor_hypothesis = chosen_neighbor
+            self.neighbor_hypothesis_energy = chosen_neighbor.combined_energy
+            self.current_hypothesis = chosen_neighbor
+            self.current_hypothesis_energy = chosen_neighbor.combined_energy
+            return True
+        return False
+
+    def _get_evaluated_neighbors(self, hypothesis, number_of_neighbors):
+        """makes the neighbors in this process, so the random choices do not depend on the number of processes,
+        and evaluates them in the neighbors evaluation pool (if there is one)"""
+        neighbors = list()
+        mutated_neighbors = list()
+        for _ in range(number_of_neighbors):
+            mutation_result, neighbor = hypothesis.get_neighbor()
+            if mutation_result:
+                neighbors.append(neighbor)
+                mutated_neighbors.append(neighbor)
+            else:
+                neighbors.append(hypothesis)
+        if self.neighbors_evaluation_pool:
+            evaluation_states = self.neighbors_evaluation_pool.map(_get_evaluation_state, mutated_neighbors)
+        else:
+            evaluation_states = map(_get_evaluation_state, mutated_neighbors)
+        for neighbor, evaluation_state in zip(mutated_neighbors, evaluation_states):
+            neighbor.set_evaluation_state(evaluation_state)
+        return neighbors
 
     def _after_loop(self):
         current_time = time.time()
         logger.info("*"*10 + " Final Hypothesis " + "*"*10)
         self._log_hypothesis_state()
+        if self.neighbors_evaluation_pool:
+            self.neighbors_evaluation_pool.close()
+            self.neighbors_evaluation_pool.join()
+            self.neighbors_evaluation_pool = None
         logger.info("simulated annealing runtime was: {}".format(_pretty_runtime_str(current_time - self.start_time)))
 
+    def _terminate_neighbors_evaluation_pool(self):
+        """stops the workers of the neighbors evaluation pool if the run raised before _after_loop closed it"""
+        if self.neighbors_evaluation_pool:
+            self.neighbors_evaluation_pool.terminate()
+            self.neighbors_evaluation_pool.join()
+            self.neighbors_evaluation_pool = None
+
     def _check_for_intervals(self):
         if not self.step % get_configuration("DEBUG_LOGGING_INTERVAL"):
             self._debug_interval()
         if not self.step % get_configuration("SLACK_NOTIFICATION_INTERVAL"):
             self. _send_hypothesis_state_to_slack()
-        if not self.step % get_configuration("CLEAR_MODULES_CACHING_INTERVAL"):
-            self.clear_modules_caching()
 
     def _debug_interval(self):
         current_time = time.time()
@@ -140,6 +216,8 @@ class SimulatedAnnealing:
         logger.info("Time from last interval: {}".format(_pretty_runtime_str(time_from_last_interval)))
         logger.info("Time to finish based on current interval: {}".format(self.by_interval_time(time_from_last_interval)))
         self.previous_interval_time = current_time
+        for line in get_caches_statistics_lines():
+            logger.info(line)
 
         #write_to_dot(self.current_hypothesis.grammar.lexicon.hmm, f"current_hypothesis_hmm_{self.step}")
 
@@ -182,11 +260,27 @@ class SimulatedAnnealing:
         return step
 
 
-    def clear_modules_caching(self):
-        Grammar.clear_caching()
-        ConstraintSet.clear_caching()
-        Constraint.clear_caching()
-        Word.clear_caching()
+def _get_evaluation_state(hypothesis):
+    hypothesis.get_energy()
+    return hypothesis.get_evaluation_state()
+
+
+def _log_sum_exp(log_values):
+    maximal_log_value = max(log_values)
+    if maximal_log_value == float("-inf"):
+        return maximal_log_value
+    return maximal_log_value + log(sum(exp(log_value - maximal_log_value) for log_value in log_values))
+
+
+def _choose_index_by_log_weight(log_weights):
+    maximal_log_weight = max(log_weights)
+    weights = [exp(log_weight - maximal_log_weight) for log_weight in log_weights]
+    random_weight = random.random() * sum(weights)
+    for index, weight in enumerate(weights):
+        random_weight -= weight
+        if random_weight < 0:
+            return index
+    return len(weights) - 1
 
 
 def _pretty_runtime_str(run_time_in_seconds):
@@ -57,7 +57,25 @@ configurations_dict = {
     "DEBUG_LOGGING_INTERVAL": 50,
     "CORPUS_DUPLICATION_FACTOR": 1,
     "LOG_LEXICON_WORDS": False,
-    "CLEAR_MODULES_CACHING_INTERVAL": 1_000
+    "GRAMMAR_OUTPUTS_CACHE_SIZE": 100_000,
+    "GRAMMAR_TRANSDUCERS_CACHE_SIZE": 200,
+    "GRAMMAR_TRANSDUCERS_CACHE_TOTAL_SIZE": 500_000,  # states and arcs of the cached transducers
+    "COST_PACKERS_CACHE_SIZE": 200,
+    "CONSTRAINT_SET_TRANSDUCERS_CACHE_SIZE": 200,
+    "CONSTRAINT_SET_TRANSDUCERS_CACHE_TOTAL_SIZE": 2_000_000,
+    "CONSTRAINT_TRANSDUCERS_CACHE_SIZE": 1_000,
+    "CONSTRAINT_TRANSDUCERS_CACHE_TOTAL_SIZE": 1_000_000,
+    "WORD_TRANSDUCERS_CACHE_SIZE": 10_000,
+    "TRANSDUCERS_DISK_CACHE_DIRECTORY": None,
+    "NUMBER_OF_CHAINS": 1,
+    "TEMPERATURE_LADDER_RATIO": 2,
+    "REPLICA_SWAP_INTERVAL": 100,
+    "NUMBER_OF_NEIGHBORS_PER_STEP": 1,
+    "NEIGHBORS_EVALUATION_PROCESSES": 1,
+    "GENERATION_PROCESSES": 1,
+    "GENERATION_CHUNK_SIZE": 1_000,
+    "GENERATE_FROM_LEXICON_AUTOMATON": False,
+    "PRUNE_GENERATION_TO_DATA": False
 }
 
 log_file_template = "{}_abnese_50_0_99995_0_01_{}.txt"
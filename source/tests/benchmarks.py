@@ -0,0 +1,245 @@
+"""
+Micro benchmarks for the grammar building hot paths.
+a feature table is a process wide singleton, so every fixture runs in a subprocess of its own:
+
+python -m tests.benchmarks [benchmark_name]
+"""
+import itertools
+import random
+import subprocess
+import sys
+import time
+
+from configuration import Configuration
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from simulated_annealing import SimulatedAnnealing
+from word import Word
+from transducer import Transducer, Arc, CostVector
+from compact_transducer import CompactTransducer
+from transducers_optimization_tools import _get_optimal_costs, get_cost_packer
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+
+
+fixtures = {
+    "tuvan": ("simulations.dag_zook", "tuvan_feature_table.json", "tuvan_constraint_set.json",
+              ['maslo', 'maslolar', 'buga', 'bugalar', 'ygy', 'ygylar', 'teve', 'tevelar', 'orun', 'orunnar']),
+    "vowel_harmony": ("simulations.vowel_harmony", "vowel_harmony_simple_feature_table.json",
+                      "vowel_harmony_simple_constraint_set.json",
+                      ["unu", "uku", "nunu", "kunu", "unukun", "ukukun", "inikun", "ikikun", "ninikun"]),
+}
+
+
+def _load_fixture(fixture_name):
+    simulation_module_name, feature_table_file_name, constraint_set_file_name, words = fixtures[fixture_name]
+    simulation = __import__(simulation_module_name, fromlist=["configurations_dict"])
+    Configuration().load_configurations_from_dict(dict(simulation.configurations_dict))
+    FeatureTable.load(get_feature_table_fixture(feature_table_file_name))
+    constraint_set = ConstraintSet.load(get_constraint_set_fixture(constraint_set_file_name))
+    return constraint_set, [Word(word) for word in words]
+
+
+def arc_intersect_calls(fixture_name):
+    """number of arc pairs unified while building the grammar and generating, compared with the
+    |A1|*|A2| Arc.intersect calls of the full product construction"""
+    constraint_set, words = _load_fixture(fixture_name)
+    counters = {"product": 0, "unify": 0}
+
+    original_binary_intersection = Transducer._binary_intersection.__func__
+    original_compact_binary_intersection = CompactTransducer._binary_intersection.__func__
+    original_unify = Arc.unify
+
+    def counting_binary_intersection(cls, transducer1, transducer2):
+        counters["product"] += len(transducer1.get_arcs()) * len(transducer2.get_arcs())
+        return original_binary_intersection(cls, transducer1, transducer2)
+
+    def counting_compact_binary_intersection(cls, transducer1, transducer2):
+        counters["product"] += transducer1.get_number_of_arcs() * transducer2.get_number_of_arcs()
+        transducer = original_compact_binary_intersection(cls, transducer1, transducer2)
+        counters["unify"] += _get_number_of_compact_arc_pairs(transducer1, transducer2, transducer)
+        return transducer
+
+    def counting_unify(arc1, arc2):
+        counters["unify"] += 1
+        return original_unify(arc1, arc2)
+
+    Transducer._binary_intersection = classmethod(counting_binary_intersection)
+    CompactTransducer._binary_intersection = classmethod(counting_compact_binary_intersection)
+    Arc.unify = staticmethod(counting_unify)
+
+    start_time = time.time()
+    grammar = Grammar(constraint_set, None)
+    for word in words:
+        grammar.generate(word)
+    run_time = time.time() - start_time
+
+    print("{}: {:,} arc pairs unified instead of {:,} ({:.1%}), {:.2f} seconds".format(
+        fixture_name, counters["unify"], counters["product"], counters["unify"] / counters["product"], run_time))
+
+
+def _get_number_of_compact_arc_pairs(transducer1, transducer2, product):
+    """the arc pairs CompactTransducer._binary_intersection unified to build product: the arcs of transducer2
+    with the input of the arc of transducer1 (or a joker) at every reached state pair"""
+    joker_id = transducer1.symbol_table.joker_id
+    number_of_arc_pairs = 0
+    for state in range(product.number_of_states):
+        state1, state2 = product.state_pairs[2 * state], product.state_pairs[2 * state + 1]
+        inputs2 = [transducer2.arc_inputs[arc2] for arc2 in transducer2.get_arc_range(state2)]
+        for arc1 in transducer1.get_arc_range(state1):
+            input1 = transducer1.arc_inputs[arc1]
+            number_of_arc_pairs += len(inputs2) if input1 == joker_id else \
+                sum(1 for input2 in inputs2 if input2 in (input1, joker_id))
+    return number_of_arc_pairs
+
+
+def _legacy_get_optimal_costs(transducer, initial_state, states):
+    """the linear scan selection remove_suboptimal_paths used before the heap: random start, O(n^2)"""
+    def get_cheapest_state(list_of_states, cost_by_state_dict):
+        most_harmonic_state = random.choice(list_of_states)
+        most_harmonic_cost_vector = cost_by_state_dict[most_harmonic_state]
+        for state in list_of_states:
+            if cost_by_state_dict[state] > most_harmonic_cost_vector:
+                most_harmonic_cost_vector = cost_by_state_dict[state]
+                most_harmonic_state = state
+        return most_harmonic_state
+
+    active_states = set(states)
+    costs = {state: CostVector.get_inf_vector() for state in active_states}
+    costs[initial_state] = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
+    while active_states:
+        cheapest_state = get_cheapest_state(list(active_states), costs)
+        active_states.remove(cheapest_state)
+        for state in active_states:
+            for arc in transducer.get_arcs_by_origin_and_terminal_state(cheapest_state, state):
+                costs[state] = max(costs[state], costs[cheapest_state] + arc.cost_vector)
+    return costs
+
+
+def _get_optimal_paths_searches(constraint_set):
+    """the (machine, initial state, reachable states) searches of make_optimal_paths"""
+    constraint_set_transducer = constraint_set.get_transducer().to_transducer()
+    searches = list()
+    for segment in constraint_set_transducer.get_alphabet():
+        word_transducer = Word(segment.get_symbol()).get_transducer()
+        intersected_machine = Transducer.intersection(word_transducer, constraint_set_transducer)
+        for state in constraint_set_transducer.get_states():
+            initial_state = word_transducer.initial_state & state
+            if initial_state in intersected_machine.get_states():
+                reachable_states = intersected_machine.get_reachable_states(initial_state)
+                searches.append((intersected_machine, initial_state, reachable_states))
+    return searches
+
+
+def optimal_costs(fixture_name):
+    """heap based optimal costs against the linear scan, over the machines make_optimal_paths searches"""
+    constraint_set, _ = _load_fixture(fixture_name)
+    searches = _get_optimal_paths_searches(constraint_set)
+
+    run_times = dict()
+    results = dict()
+    for name, function in [("linear scan", _legacy_get_optimal_costs), ("heap", _get_optimal_costs)]:
+        start_time = time.time()
+        results[name] = [function(*search) for search in searches]
+        run_times[name] = time.time() - start_time
+    assert results["linear scan"] == results["heap"]
+
+    print("{}: {} searches of {:.0f} states on average - linear scan {:.2f} seconds, heap {:.2f} seconds".format(
+        fixture_name, len(searches), sum(len(search[2]) for search in searches) / len(searches),
+        run_times["linear scan"], run_times["heap"]))
+
+
+def packed_costs(fixture_name):
+    """optimal costs on packed ints against CostVectors, over the machines make_optimal_paths searches"""
+    constraint_set, _ = _load_fixture(fixture_name)
+    searches = _get_optimal_paths_searches(constraint_set)
+    cost_packers = [get_cost_packer(search[0], len(search[2])) for search in searches]
+
+    start_time = time.time()
+    vector_results = [_get_optimal_costs(*search) for search in searches]
+    vector_run_time = time.time() - start_time
+    start_time = time.time()
+    packed_results = [_get_optimal_costs(*search, cost_packer) for search, cost_packer in zip(searches, cost_packers)]
+    packed_run_time = time.time() - start_time
+    for vector_costs, packed_costs, cost_packer in zip(vector_results, packed_results, cost_packers):
+        assert vector_costs == {state: cost_packer.unpack(cost) for state, cost in packed_costs.items()}
+
+    print("{}: {} searches - CostVector {:.2f} seconds, packed {:.2f} seconds".format(
+        fixture_name, len(searches), vector_run_time, packed_run_time))
+
+
+def step_rate(fixture_name, number_of_neighbors=2_000, number_of_steps=100):
+    """neighbors made by pickling the whole grammar against neighbors that share the unmutated component,
+    and the annealing steps per second (with the simulation's configuration)"""
+    constraint_set, words = _load_fixture(fixture_name)
+    underlying_forms = [str(word) for word in words]
+    grammar = Grammar(constraint_set, Lexicon(underlying_forms, max(len(word) for word in underlying_forms)))
+    data = sorted({output for word in words for output in grammar.generate(word)})
+    hypothesis = Hypothesis(grammar, data)
+    hypothesis_signature = (str(hypothesis.grammar.constraint_set), hypothesis.grammar.lexicon.hmm.get_log_lines())
+
+    def pickled_neighbor():
+        new_hypothesis = hypothesis.get_hypothesis_copy()
+        return new_hypothesis.grammar.make_mutation(), new_hypothesis
+
+    neighbor_rates = dict()
+    for name, get_neighbor in [("pickled", pickled_neighbor), ("shared", hypothesis.get_neighbor)]:
+        random.seed(1)
+        start_time = time.time()
+        for _ in range(number_of_neighbors):
+            get_neighbor()
+        neighbor_rates[name] = number_of_neighbors / (time.time() - start_time)
+    assert hypothesis_signature == (str(hypothesis.grammar.constraint_set),
+                                    hypothesis.grammar.lexicon.hmm.get_log_lines())  # nothing shared was mutated
+
+    Configuration()["STEPS_LIMITATION"] = number_of_steps
+    Configuration()["DEBUG_LOGGING_INTERVAL"] = number_of_steps + 1
+    simulated_annealing = SimulatedAnnealing(hypothesis, 0)
+    start_time = time.time()
+    simulated_annealing.run()
+    run_time = time.time() - start_time
+
+    print("{}: neighbors per second - pickled {:,.0f}, shared {:,.0f}; {:.1f} annealing steps per second".format(
+        fixture_name, neighbor_rates["pickled"], neighbor_rates["shared"], number_of_steps / run_time))
+
+
+def trie_generation(fixture_name, number_of_words=3_000):
+    """outputs of the shortest number_of_words strings (as an alphabet lexicon), from an intersection per word
+    against one pass over their trie"""
+    constraint_set, _ = _load_fixture(fixture_name)
+    grammar = Grammar(constraint_set, None)
+    grammar.get_transducer()
+    symbols = [segment.get_symbol() for segment in grammar.feature_table.get_segments()]
+    word_strings = itertools.chain.from_iterable(map("".join, itertools.product(symbols, repeat=length))
+                                                 for length in itertools.count(1))
+    words = [Word(word_string) for word_string in itertools.islice(word_strings, number_of_words)]
+
+    start_time = time.time()
+    outputs_by_word = {word: grammar._get_outputs(word) for word in words}
+    per_word_run_time = time.time() - start_time
+    start_time = time.time()
+    trie_outputs_by_word = grammar._get_outputs_of_words(words)
+    trie_run_time = time.time() - start_time
+    assert trie_outputs_by_word == outputs_by_word
+
+    print("{}: {:,} words - intersection per word {:.2f} seconds, trie {:.2f} seconds".format(
+        fixture_name, len(words), per_word_run_time, trie_run_time))
+
+
+benchmarks = {"arc_intersect_calls": arc_intersect_calls,
+              "optimal_costs": optimal_costs,
+              "packed_costs": packed_costs,
+              "step_rate": step_rate,
+              "trie_generation": trie_generation}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        benchmarks[sys.argv[1]](sys.argv[2])
+    else:
+        benchmark_names = sys.argv[1:] or list(benchmarks)
+        for benchmark_name in benchmark_names:
+            for fixture_name in fixtures:
+                subprocess.run([sys.executable, "-m", "tests.benchmarks", benchmark_name, fixture_name])
@@ -16,6 +16,20 @@ configurations_dict = {
     "DATA_ENCODING_LENGTH_MULTIPLIER": 25,
     "GRAMMAR_ENCODING_LENGTH_MULTIPLIER": 1,
     "CORPUS_DUPLICATION_FACTOR": 1,
+    "GRAMMAR_OUTPUTS_CACHE_SIZE": 100_000,
+    "GRAMMAR_TRANSDUCERS_CACHE_SIZE": 200,
+    "GRAMMAR_TRANSDUCERS_CACHE_TOTAL_SIZE": 500_000,
+    "COST_PACKERS_CACHE_SIZE": 200,
+    "CONSTRAINT_SET_TRANSDUCERS_CACHE_SIZE": 200,
+    "CONSTRAINT_SET_TRANSDUCERS_CACHE_TOTAL_SIZE": 2_000_000,
+    "CONSTRAINT_TRANSDUCERS_CACHE_SIZE": 1_000,
+    "CONSTRAINT_TRANSDUCERS_CACHE_TOTAL_SIZE": 1_000_000,
+    "WORD_TRANSDUCERS_CACHE_SIZE": 10_000,
+    "TRANSDUCERS_DISK_CACHE_DIRECTORY": None,
+    "GENERATION_PROCESSES": 1,
+    "GENERATION_CHUNK_SIZE": 1_000,
+    "GENERATE_FROM_LEXICON_AUTOMATON": False,
+    "PRUNE_GENERATION_TO_DATA": False,
 }
 
 configuration = Configuration()
@@ -0,0 +1,34 @@
+from configuration import Configuration
+from bounded_cache import BoundedCache
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict({"TEST_CACHE_SIZE": 2, "TEST_SIZED_CACHE_SIZE": 10,
+                                             "TEST_SIZED_CACHE_TOTAL_SIZE": 10})
+
+cache = BoundedCache("test", "TEST_CACHE_SIZE")
+cache["a"] = 1
+cache["b"] = 2
+assert cache.get("a") == 1      # "a" is now the most recently used
+cache["c"] = 3                  # evicts "b"
+assert "b" not in cache and "a" in cache and "c" in cache
+assert cache.get("b") is None
+assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+print(cache.get_statistics_line())
+
+# the size is read from the configuration on insertion
+configuration["TEST_CACHE_SIZE"] = 1
+cache["d"] = 4
+assert len(cache) == 1 and cache.get("d") == 4
+
+# entries are also evicted beyond the total size of their entries
+sized_cache = BoundedCache("sized", "TEST_SIZED_CACHE_SIZE", "TEST_SIZED_CACHE_TOTAL_SIZE", len)
+sized_cache["a"] = "xxxx"
+sized_cache["b"] = "xxxx"
+sized_cache["a"] = "xx"         # replacing an entry replaces its size
+assert sized_cache.total_size == 6 and sized_cache.evictions == 0
+sized_cache["c"] = "xxxxxx"     # evicts "b", the least recently used
+assert "b" not in sized_cache and "a" in sized_cache and sized_cache.total_size == 8
+sized_cache["d"] = "x" * 11     # larger than the total size, so it evicts everything including itself
+assert len(sized_cache) == 0 and sized_cache.total_size == 0 and sized_cache.evictions == 4
+print(sized_cache.get_statistics_line())
@@ -0,0 +1,65 @@
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Word
+from configuration import Configuration
+from transducer import Transducer
+from compact_transducer import CompactTransducer, SymbolTable
+from transducers_optimization_tools import optimize_transducer_grammar_for_word, make_optimal_paths
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations.vowel_harmony import configurations_dict
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(configurations_dict)
+
+feature_table = FeatureTable.load(get_feature_table_fixture("vowel_harmony_simple_feature_table.json"))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture("vowel_harmony_simple_constraint_set.json"))
+
+
+def get_arcs_signature(transducer):
+    return sorted((str(arc.origin_state), arc.input.get_symbol(),
+                   str(sorted(arc.output)) if isinstance(arc.output, set) else arc.output.get_symbol(),
+                   str(arc.cost_vector), str(arc.terminal_state)) for arc in transducer.get_arcs())
+
+
+# lossless round trip
+constraint_set_transducer = Transducer.intersection(*[constraint.get_transducer()
+                                                      for constraint in constraint_set.constraints])
+compact_constraint_set_transducer = CompactTransducer.from_transducer(constraint_set_transducer)
+print(constraint_set_transducer.get_info())
+print(compact_constraint_set_transducer.get_info())
+round_trip_transducer = compact_constraint_set_transducer.to_transducer()
+assert get_arcs_signature(round_trip_transducer) == get_arcs_signature(constraint_set_transducer)
+assert round_trip_transducer.initial_state == constraint_set_transducer.initial_state
+assert set(round_trip_transducer.final_states) == set(constraint_set_transducer.final_states)
+
+# the constraint set transducer is built compact, and make_optimal_paths searches it natively
+assert get_arcs_signature(constraint_set.get_transducer().to_transducer()) == \
+       get_arcs_signature(constraint_set_transducer)
+assert get_arcs_signature(make_optimal_paths(constraint_set.get_transducer())) == \
+       get_arcs_signature(make_optimal_paths(constraint_set_transducer))
+
+# the symbol ids of a family of transducers are of its own table
+try:
+    CompactTransducer.intersection(CompactTransducer.from_transducer(Word("unu").get_transducer()),
+                                   constraint_set.get_transducer())
+    assert False, "transducers of different symbol tables were intersected"
+except ValueError:
+    pass
+
+# intersection and range
+grammar = Grammar(constraint_set, None)
+symbol_table = SymbolTable()
+compact_grammar_transducer = CompactTransducer.from_transducer(grammar.get_transducer(), symbol_table)
+for word_string in ["unu", "nunukun", "kikikun", "inikun"]:
+    word = Word(word_string)
+    intersected_transducer = Transducer.intersection(word.get_transducer(), grammar.get_transducer())
+    compact_intersected_transducer = CompactTransducer.intersection(
+        CompactTransducer.from_transducer(word.get_transducer(), symbol_table), compact_grammar_transducer)
+    assert get_arcs_signature(compact_intersected_transducer.to_transducer()) == \
+           get_arcs_signature(intersected_transducer)
+
+    outputs = optimize_transducer_grammar_for_word(word, compact_intersected_transducer).get_range()
+    print(f"{word} --> {outputs}")
+    assert outputs == grammar.generate(word)
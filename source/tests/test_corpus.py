@@ -0,0 +1,67 @@
+import gzip
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus, read_corpus_file
+from configuration import Configuration
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture, get_corpus_fixture
+from simulations import vowel_harmony, abnese
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+
+# the duplicates are counted, not stored
+set_configuration("CORPUS_DUPLICATION_FACTOR", 2.5)
+corpus = Corpus(["unu", "uku", "unu", "kiki"])
+assert corpus.get_words() == ["unu", "uku", "unu", "kiki"] * 2 + ["unu", "uku"]
+assert len(corpus) == 10 and corpus.get_count("unu") == 5 and corpus.get_count("kiki") == 2
+assert corpus.get_distinct_words() == ["unu", "uku", "kiki"] and corpus.get_max_word_length() == 4
+assert dict(corpus.get_index().get_multiplicities()) == {"unu": 5, "uku": 3, "kiki": 2}
+
+set_configuration("CORPUS_DUPLICATION_FACTOR", 0.5)
+assert Corpus(["unu", "uku", "kiki", "iki"]).get_distinct_words() == ["unu", "uku"]
+
+
+def get_data_energy(duplication_factor):
+    set_configuration("CORPUS_DUPLICATION_FACTOR", duplication_factor)
+    corpus = Corpus(vowel_harmony.corpus)
+    lexicon = Lexicon(corpus.get_distinct_words(), corpus.get_max_word_length())
+    hypothesis = Hypothesis(Grammar(constraint_set, lexicon), corpus)
+    hypothesis.get_energy()
+    assert Hypothesis(hypothesis.grammar, corpus.get_words()).get_energy() == hypothesis.combined_energy
+    return hypothesis.data_energy
+
+
+# every distinct word is evaluated once, and its encoding length is multiplied by its count
+assert get_data_energy(3) == 3 * get_data_energy(1)
+print("data energy: {:,}".format(get_data_energy(1)))
+
+
+# a corpus file is read once, with a word or a word and its count in every line
+set_configuration("CORPUS_DUPLICATION_FACTOR", 1)
+corpus_from_words = Corpus(abnese.corpus)
+for corpus_file_name in ["abnese_corpus.txt", "abnese_corpus_counts.txt", "abnese_corpus_counts.txt.gz"]:
+    loaded_corpus = Corpus.load(get_corpus_fixture(corpus_file_name))
+    assert sorted(loaded_corpus.get_words()) == sorted(abnese.corpus)
+    assert loaded_corpus.count_by_word == corpus_from_words.count_by_word
+    assert loaded_corpus.get_max_word_length() == corpus_from_words.get_max_word_length()
+
+with TemporaryDirectory() as corpora_dir_path:
+    gzip_corpus_file_name = join(corpora_dir_path, "corpus.txt.gz")
+    with gzip.open(gzip_corpus_file_name, "wt", encoding="utf-8") as gzip_corpus_file:
+        gzip_corpus_file.write("unu\t3\nunu\n\nkiki\t2\nunu\n")
+    assert list(read_corpus_file(gzip_corpus_file_name)) == [("unu", 3), ("unu", 1), ("kiki", 2), ("unu", 1)]
+    set_configuration("CORPUS_DUPLICATION_FACTOR", 1.5)
+    loaded_corpus = Corpus.load(gzip_corpus_file_name)
+    assert loaded_corpus.get_words() == Corpus(["unu"] * 5 + ["kiki"] * 2).get_words()
+    assert dict(loaded_corpus.get_index().get_multiplicities()) == {"unu": 8, "kiki": 2}
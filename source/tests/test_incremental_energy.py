@@ -0,0 +1,79 @@
+import pickle
+import random
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+
+
+def assert_incremental_energy_equals_full_energy(mutation_weights, number_of_steps):
+    """walks through random neighbors, comparing the energy of each neighbor with that of a fresh copy of it"""
+    for configuration_key, weight in mutation_weights.items():
+        set_configuration(configuration_key, weight)
+    random.seed(1)
+    hypothesis = Hypothesis(Grammar(constraint_set, lexicon), data)
+    hypothesis.get_energy()
+    number_of_compared_neighbors = 0
+    for _ in range(number_of_steps):
+        mutation_result, neighbor_hypothesis = hypothesis.get_neighbor()
+        if not mutation_result:
+            continue
+        neighbor_energy = neighbor_hypothesis.get_energy()
+        full_hypothesis = Hypothesis(pickle.loads(pickle.dumps(neighbor_hypothesis.grammar, -1)), data)
+        assert neighbor_energy == full_hypothesis.get_energy()
+        assert neighbor_hypothesis.data_parse_dict == full_hypothesis.data_parse_dict
+        number_of_compared_neighbors += 1
+        if neighbor_energy != float("inf"):
+            hypothesis = neighbor_hypothesis
+    print("{}: {} neighbors compared".format(mutation_weights, number_of_compared_neighbors))
+
+
+def get_hypothesis_state(hypothesis):
+    return (hypothesis.grammar.lexicon.hmm.get_log_lines(), hypothesis.grammar.lexicon.get_words(),
+            str(hypothesis.grammar.constraint_set), hypothesis.combined_energy, hypothesis.data_parse_dict)
+
+
+def assert_undo_restores_hypothesis(mutation_weights, number_of_steps):
+    """mutates a hypothesis in place, comparing its energy with that of a fresh copy, and undoes every other
+    mutation, comparing the hypothesis with its state before the mutation"""
+    for configuration_key, weight in mutation_weights.items():
+        set_configuration(configuration_key, weight)
+    random.seed(1)
+    hypothesis = Hypothesis(Grammar(constraint_set, lexicon), data)
+    hypothesis.get_energy()
+    number_of_undone_mutations = 0
+    for step in range(number_of_steps):
+        state_before_mutation = get_hypothesis_state(hypothesis)
+        mutation_result, undo_record = hypothesis.make_undoable_mutation()
+        if mutation_result:
+            energy = hypothesis.get_energy()
+            full_hypothesis = Hypothesis(pickle.loads(pickle.dumps(hypothesis.grammar, -1)), data)
+            assert energy == full_hypothesis.get_energy()
+        if not mutation_result or step % 2 or energy == float("inf"):
+            hypothesis.undo_mutation(undo_record)
+            assert get_hypothesis_state(hypothesis) == state_before_mutation
+            number_of_undone_mutations += 1
+    print("{}: {} mutations undone".format(mutation_weights, number_of_undone_mutations))
+
+
+assert_incremental_energy_equals_full_energy({"MUTATE_LEXICON": 1, "MUTATE_CONSTRAINT_SET": 0}, 40)
+assert_incremental_energy_equals_full_energy({"MUTATE_LEXICON": 0, "MUTATE_CONSTRAINT_SET": 1}, 40)
+assert_incremental_energy_equals_full_energy({"MUTATE_LEXICON": 1, "MUTATE_CONSTRAINT_SET": 1}, 40)
+
+assert_undo_restores_hypothesis({"MUTATE_LEXICON": 1, "MUTATE_CONSTRAINT_SET": 1}, 40)
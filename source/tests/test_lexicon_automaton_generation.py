@@ -0,0 +1,48 @@
+import random
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict, MAX_NUM_OF_INNER_STATES=4,
+                                                 MUTATE_CONSTRAINT_SET=0))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+
+
+def get_evaluation(grammar, is_generating_from_lexicon_automaton):
+    set_configuration("GENERATE_FROM_LEXICON_AUTOMATON", is_generating_from_lexicon_automaton)
+    hypothesis = Hypothesis(grammar, data)
+    return hypothesis.get_energy(), hypothesis.data_parse_dict
+
+
+# a walk of lexicon mutations, comparing generation from the HMM nfa with generation of the enumerated words
+random.seed(1)
+grammar = Grammar(constraint_set, lexicon)
+for _ in range(30):
+    _, neighbor = grammar.get_neighbor()
+    outputs_by_word = neighbor.generate_all(neighbor.lexicon.get_words())
+    assert neighbor.generate_lexicon() == {str(word): outputs for word, outputs in outputs_by_word.items() if outputs}
+    energy, data_parse_dict = get_evaluation(neighbor, True)
+    assert (energy, data_parse_dict) == get_evaluation(neighbor, False)
+    if energy != float("inf"):
+        grammar = neighbor
+print("lexicon automaton generation equals the generation of {} lexicon words".format(len(grammar.lexicon)))
+
+# an alphabet lexicon, all the strings up to the longest word in the data
+alphabet_grammar = Grammar(constraint_set, Lexicon(data, lexicon.max_word_length_in_data, alphabet_or_words="alphabet"))
+assert get_evaluation(alphabet_grammar, True) == get_evaluation(alphabet_grammar, False)
+print("lexicon automaton generation equals the generation of {:,} alphabet lexicon words".format(
+    len(alphabet_grammar.lexicon)))
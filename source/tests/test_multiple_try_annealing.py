@@ -0,0 +1,55 @@
+import pickle
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from simulated_annealing import SimulatedAnnealing
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict,
+                                                 NUMBER_OF_NEIGHBORS_PER_STEP=4, STEPS_LIMITATION=40))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+
+
+def run_multiple_try_annealing(number_of_processes):
+    set_configuration("NEIGHBORS_EVALUATION_PROCESSES", number_of_processes)
+    hypothesis = Hypothesis(pickle.loads(pickle.dumps(Grammar(constraint_set, lexicon), -1)), data)
+    simulated_annealing = SimulatedAnnealing(hypothesis, vowel_harmony.target_energy)
+    _, final_hypothesis = simulated_annealing.run()
+    energy = simulated_annealing.current_hypothesis_energy
+    assert Hypothesis(pickle.loads(pickle.dumps(final_hypothesis.grammar, -1)), data).get_energy() == energy
+    return energy, str(final_hypothesis.grammar.constraint_set), final_hypothesis.grammar.lexicon.hmm.get_log_lines()
+
+
+# the neighbors are made in the main process, so the run does not depend on the number of processes
+serial_run = run_multiple_try_annealing(1)
+parallel_run = run_multiple_try_annealing(3)
+assert serial_run == parallel_run
+print("final energy: {:,}".format(serial_run[0]))
+
+
+# the workers of the pool are stopped when the run raises
+class InterruptedSimulatedAnnealing(SimulatedAnnealing):
+    def _make_step(self):
+        self.workers = list(self.neighbors_evaluation_pool._pool)
+        raise KeyboardInterrupt
+
+interrupted_simulated_annealing = InterruptedSimulatedAnnealing(Hypothesis(Grammar(constraint_set, lexicon), data), None)
+try:
+    interrupted_simulated_annealing.run()
+except KeyboardInterrupt:
+    pass
+assert interrupted_simulated_annealing.neighbors_evaluation_pool is None
+assert not any(worker.is_alive() for worker in interrupted_simulated_annealing.workers)
@@ -0,0 +1,33 @@
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict,
+                                                 GENERATION_PROCESSES=3, GENERATION_CHUNK_SIZE=5))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+grammar = Grammar(constraint_set, lexicon)
+
+parallel_hypothesis = Hypothesis(grammar, data)
+parallel_energy = parallel_hypothesis.get_energy()
+parallel_outputs_by_word = grammar.generate_all(lexicon.get_words())  # cached by the parallel parse_data
+
+Grammar.clear_caching()
+set_configuration("GENERATION_PROCESSES", 1)
+serial_hypothesis = Hypothesis(grammar, data)
+assert serial_hypothesis.get_energy() == parallel_energy
+assert serial_hypothesis.data_parse_dict == parallel_hypothesis.data_parse_dict
+assert {word: grammar.generate(word) for word in lexicon.get_words()} == parallel_outputs_by_word
+print("{} lexicon words generated in parallel, energy: {:,}".format(len(parallel_outputs_by_word), parallel_energy))
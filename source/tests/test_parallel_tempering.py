@@ -0,0 +1,38 @@
+import pickle
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from parallel_tempering import ParallelTempering
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict,
+                                                 NUMBER_OF_CHAINS=3, STEPS_LIMITATION=60, REPLICA_SWAP_INTERVAL=20))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+
+hypothesis = Hypothesis(Grammar(constraint_set, lexicon), data)
+initial_energy = hypothesis.get_energy()
+
+best_hypothesis, chain_statistics = ParallelTempering(hypothesis, vowel_harmony.target_energy).run()
+for statistics in chain_statistics:
+    print(statistics)
+
+assert len(chain_statistics) == 3
+assert all(statistics.number_of_steps == 60 for statistics in chain_statistics)
+assert all(statistics.number_of_swap_attempts > 0 for statistics in chain_statistics)
+best_energy = min(statistics.best_energy for statistics in chain_statistics)
+assert best_hypothesis.get_energy() == best_energy <= initial_energy
+assert Hypothesis(pickle.loads(pickle.dumps(best_hypothesis.grammar, -1)), data).get_energy() == best_energy
+# the chains run in their own processes - the hypothesis of this process is not mutated
+assert hypothesis.get_energy() == initial_energy
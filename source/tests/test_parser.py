@@ -0,0 +1,51 @@
+from FAdo.fa import NFA, Epsilon
+
+from configuration import Configuration
+from feature_table import FeatureTable
+from hmm import HMM
+from parser import ParsingNFA, NULL_SEGMENT
+from tests.persistence_tools import get_feature_table_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict))
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+
+# a word list HMM - q1 emits one of three words, so the transition from q1_start is encoded with 2 bits
+parsing_nfa = ParsingNFA.get_from_fado_nfa(HMM.create_hmm_from_list(["unu", "uku", "u"]).nfa)
+assert parsing_nfa.parse("unu") == (["q0", "q1_start", "q1,0,0", "q1,0,1", "q1_end", "qf"],
+                                    [NULL_SEGMENT, "u", "n", "u", NULL_SEGMENT])
+assert parsing_nfa.get_observation_encoding_length("unu") == 2
+assert parsing_nfa.parse("u") == (["q0", "q1_start", "q1_end", "qf"], [NULL_SEGMENT, "u", NULL_SEGMENT])
+assert parsing_nfa.parse("kun") is None
+
+# an alphabet HMM - every segment is a loop through q1, and leaving q1 (or not) is encoded with a bit
+parsing_nfa = ParsingNFA.get_from_fado_nfa(HMM.create_hmm_alphabet(["u", "n", "k"]).nfa)
+states_path, outputs_path = parsing_nfa.parse("unku")
+assert states_path == ["q0"] + ["q1_start", "q1_end"] * 4 + ["qf"]
+assert "".join(output for output in outputs_path if output != NULL_SEGMENT) == "unku"
+assert parsing_nfa.get_observation_encoding_length("unku") == 4
+assert parsing_nfa.parse("") is None
+
+# a batch of observations shares the columns of their common prefixes, and every observation is parsed once
+observations = ["unku", "unk", "un", "kun", "unnu", "", "ku"]
+parses = ParsingNFA.get_from_fado_nfa(HMM.create_hmm_alphabet(["u", "n", "k"]).nfa).parse_all(observations)
+assert parses == {observation: parsing_nfa.parse(observation) for observation in observations}
+assert parsing_nfa.parse("unku") is parsing_nfa.parse("unku")
+assert parsing_nfa.get_observations_encoding_lengths(["unku", "kun"]) == {"unku": 4, "kun": 3}
+
+# epsilon paths of more than one arc, in a cycle - the closure of q0 reaches b through a
+nfa = NFA()
+state_indexes = {state: nfa.addState(state) for state in ["q0", "a", "b", "c", "qf"]}
+nfa.setInitial([state_indexes["q0"]])
+nfa.setFinal([state_indexes["qf"]])
+for state1, segment, state2 in [("q0", Epsilon, "a"), ("a", Epsilon, "b"), ("b", Epsilon, "a"), ("a", "x", "c"),
+                                ("b", "y", "c"), ("c", Epsilon, "qf"), ("c", Epsilon, "a")]:
+    nfa.addTransition(state_indexes[state1], segment, state_indexes[state2])
+parsing_nfa = ParsingNFA.get_from_fado_nfa(nfa)
+assert parsing_nfa.parse("y") == (["q0", "a", "b", "c", "qf"], [NULL_SEGMENT, NULL_SEGMENT, "y", NULL_SEGMENT])
+assert parsing_nfa.parse("xy") == (["q0", "a", "c", "a", "b", "c", "qf"],
+                                   [NULL_SEGMENT, "x", NULL_SEGMENT, NULL_SEGMENT, "y", NULL_SEGMENT])
+assert parsing_nfa.get_observation_encoding_length("xy") == 5
+print("parses are as expected")
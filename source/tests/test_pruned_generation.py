@@ -0,0 +1,52 @@
+import random
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from hypothesis import Hypothesis
+from corpus import Corpus
+from configuration import Configuration
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict, MAX_NUM_OF_INNER_STATES=4,
+                                                 CORPUS_DUPLICATION_FACTOR=2))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+lexicon = Lexicon(data, max([len(word) for word in data]))
+
+
+def get_evaluation(grammar, is_pruning_generation_to_data, is_generating_from_lexicon_automaton):
+    set_configuration("PRUNE_GENERATION_TO_DATA", is_pruning_generation_to_data)
+    set_configuration("GENERATE_FROM_LEXICON_AUTOMATON", is_generating_from_lexicon_automaton)
+    Grammar.clear_caching()  # the full outputs of all the words would otherwise be cached by the first evaluation
+    hypothesis = Hypothesis(grammar, data)
+    return hypothesis.get_energy(), hypothesis.data_parse_dict
+
+
+def assert_pruned_evaluations_equal_full_evaluation(grammar):
+    full_evaluation = get_evaluation(grammar, False, False)
+    assert get_evaluation(grammar, True, False) == full_evaluation
+    assert get_evaluation(grammar, True, True) == full_evaluation
+    return full_evaluation[0]
+
+
+# a walk of lexicon and constraint set mutations
+random.seed(1)
+grammar = Grammar(constraint_set, lexicon)
+for _ in range(30):
+    _, neighbor = grammar.get_neighbor()
+    if assert_pruned_evaluations_equal_full_evaluation(neighbor) != float("inf"):
+        grammar = neighbor
+print("generation pruned to the data equals full generation")
+
+alphabet_grammar = Grammar(constraint_set, Lexicon(data, lexicon.max_word_length_in_data, alphabet_or_words="alphabet"))
+assert_pruned_evaluations_equal_full_evaluation(alphabet_grammar)
+print("generation pruned to the data equals full generation for {:,} alphabet lexicon words".format(
+    len(alphabet_grammar.lexicon)))
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from tempfile import TemporaryDirectory
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Word
+from configuration import Configuration
+from transducers_disk_cache import load_transducer, get_disk_cache_key
+from utils import set_configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture, tests_dir_path
+from simulations.vowel_harmony import configurations_dict
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(configurations_dict))
+
+feature_table = FeatureTable.load(get_feature_table_fixture("vowel_harmony_simple_feature_table.json"))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture("vowel_harmony_simple_constraint_set.json"))
+
+
+def get_arcs_signature(transducer):
+    return sorted((str(arc.origin_state), arc.input.get_symbol(),
+                   str(sorted(arc.output)) if isinstance(arc.output, set) else arc.output.get_symbol(),
+                   str(arc.cost_vector), str(arc.terminal_state)) for arc in transducer.get_arcs())
+
+
+# run in a process of another hash seed: the hashes of the loaded States, Segments and Arcs are those of equal
+# objects built by the loading process
+loading_code = """
+import pickle, sys
+from glob import glob
+from transducer import State, Arc
+from segment import Segment
+for file_path in glob(sys.argv[1] + "/*.pkl"):
+    with open(file_path, "rb") as file:
+        transducer = pickle.load(file)
+    for arc in transducer.get_arcs():
+        origin_state, terminal_state = State(arc.origin_state.label), State(arc.terminal_state.label)
+        input = Segment(arc.input.get_symbol())
+        assert hash(arc.origin_state) == hash(origin_state) and hash(arc.input) == hash(input)
+        assert hash(arc) == hash(Arc(origin_state, input, arc.output, arc.cost_vector, terminal_state))
+"""
+
+
+words = [Word(word_string) for word_string in ["unu", "nunukun", "kikikun", "inikun"]]
+
+with TemporaryDirectory() as disk_cache_directory:
+    set_configuration("TRANSDUCERS_DISK_CACHE_DIRECTORY", disk_cache_directory)
+    grammar = Grammar(constraint_set, None)
+    assert load_transducer(str(constraint_set)) is None
+    grammar_transducer = grammar.get_transducer()
+    outputs = [grammar.generate(word) for word in words]
+
+    # a cold process memory loads the transducer from the disk
+    Grammar.clear_caching()
+    cached_grammar_transducer = load_transducer(str(constraint_set))
+    assert get_arcs_signature(cached_grammar_transducer) == get_arcs_signature(grammar_transducer)
+    assert [grammar.generate(word) for word in words] == outputs
+
+    loading_hash_seed = str(int(os.environ.get("PYTHONHASHSEED", "0")) + 1)
+    subprocess.run([sys.executable, "-c", loading_code, disk_cache_directory], check=True,
+                   cwd=os.path.dirname(tests_dir_path), env=dict(os.environ, PYTHONHASHSEED=loading_hash_seed))
+
+    # the key depends on the configurations the transducers are built with
+    disk_cache_key = get_disk_cache_key(str(constraint_set))
+    set_configuration("ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS", False)
+    assert get_disk_cache_key(str(constraint_set)) != disk_cache_key
+    assert load_transducer(str(constraint_set)) is None
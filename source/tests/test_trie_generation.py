@@ -0,0 +1,43 @@
+import itertools
+import random
+
+from feature_table import FeatureTable
+from constraint_set import ConstraintSet
+from grammar import Grammar
+from lexicon import Lexicon
+from corpus import Corpus
+from word import Word
+from configuration import Configuration
+from tests.persistence_tools import get_feature_table_fixture, get_constraint_set_fixture
+from simulations import vowel_harmony
+
+
+configuration = Configuration()
+configuration.load_configurations_from_dict(dict(vowel_harmony.configurations_dict,
+                                                 INSERT_CONSTRAINT=1, REMOVE_CONSTRAINT=1,
+                                                 INSERT_FEATURE_BUNDLE_PHONOTACTIC_CONSTRAINT=1,
+                                                 REMOVE_FEATURE_BUNDLE_PHONOTACTIC_CONSTRAINT=1,
+                                                 AUGMENT_FEATURE_BUNDLE=1, DEP_FOR_INSERT=1, MAX_FOR_INSERT=1,
+                                                 IDENT_FOR_INSERT=1, PHONOTACTIC_FOR_INSERT=1))
+
+feature_table = FeatureTable.load(get_feature_table_fixture(vowel_harmony.feature_table_file_name))
+constraint_set = ConstraintSet.load(get_constraint_set_fixture(vowel_harmony.constraint_set_file_name))
+data = Corpus(vowel_harmony.corpus).get_words()
+max_word_length_in_data = max([len(word) for word in data])
+lexicon = Lexicon(data, max_word_length_in_data)
+
+# the lexicon words, the words up to length 3, and words longer than the data (generated without a cost packer)
+symbols = [segment.get_symbol() for segment in feature_table.get_segments()]
+words = lexicon.get_words() + [Word("".join(word_symbols)) for length in range(1, 4)
+                               for word_symbols in itertools.product(symbols, repeat=length)]
+words += [Word(str(word) + str(word)) for word in sorted(lexicon.get_words(), key=len)[-4:]]
+assert max(len(word) for word in words) > max_word_length_in_data
+
+random.seed(1)
+grammar = Grammar(constraint_set, lexicon)
+for _ in range(12):
+    outputs_by_word = grammar._get_outputs_of_words(words)
+    for word in words:
+        assert outputs_by_word[word] == grammar._get_outputs(word), (str(grammar.constraint_set), str(word))
+    _, grammar = grammar.get_neighbor()
+print("trie outputs of {} words equal the outputs of an intersection per word".format(len(words)))
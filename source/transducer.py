@@ -1,9 +1,10 @@
 from copy import deepcopy
 import functools
-import itertools
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
 from io import StringIO
+from operator import add, sub, mul
+import sys
 
 from segment import Segment, NULL_SEGMENT, JOKER_SEGMENT
 
@@ -12,7 +13,7 @@ logger = logging.getLogger(__name__)
 
 class Transducer:
     __slots__ = ["name", "states", "alphabet", "_arcs", "initial_state", "final_states", "arcs_by_state_dict",
-                 "length_of_cost_vectors"]
+                 "length_of_cost_vectors", "arc_index"]
 
     def __init__(self, alphabet, name=None, length_of_cost_vectors=1):
         self.name = name
@@ -23,6 +24,15 @@ class Transducer:
         self.final_states = list()
         self.arcs_by_state_dict = dict()
         self.length_of_cost_vectors = length_of_cost_vectors
+        self.arc_index = None  # built on demand by get_arc_index, dropped whenever the arcs change
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__ if slot != "arc_index"}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self.arc_index = None
 
     def set_as_single_state(self, state):
         self.initial_state = state
@@ -53,11 +63,18 @@ class Transducer:
     def get_arcs(self):
         return self._arcs
 
+    def get_arc_index(self):
+        if self.arc_index is None:
+            self.arc_index = ArcIndex(self)
+        return self.arc_index
+
     def remove_arc(self, arc):
         self.arcs_by_state_dict[arc.origin_state][arc.terminal_state].remove(arc)
         self._arcs.remove(arc)
+        self.arc_index = None
 
     def add_arc(self, arc):
+        self.arc_index = None
         if arc.origin_state not in self.arcs_by_state_dict:
             self.arcs_by_state_dict[arc.origin_state] = dict()
         if arc.terminal_state not in self.arcs_by_state_dict[arc.origin_state]:
@@ -73,78 +90,58 @@ class Transducer:
         a state that cannot be reached from the initial state by following any path  (unreachable state)
         or
         a state that cannot reach a final state by following any path (impasse state)
+
+        Reachable states are found with one BFS over arcs_by_state_dict (see get_reachable_states), and states that
+        can reach a final state with one BFS over the reversed arcs.
         """
         #logger.debug("clear_dead_states: transducer before: %s", self)
-        #clear unreachable states:
-        state_unreachable_dict = {state: True for state in self.states}  # all states are unreachable at first
-        state_unreachable_dict[self.initial_state] = False               # except for initial state
-
-        while True:    # "do while" loop
-            change_in_dict = False
-            for arc in self._arcs:
-                if not state_unreachable_dict[arc.origin_state] and state_unreachable_dict[arc.terminal_state]:
-                    state_unreachable_dict[arc.terminal_state] = False
-                    change_in_dict = True
-
-            if not change_in_dict:
-                break
-
-        unreachable_states = [state for state in state_unreachable_dict if state_unreachable_dict[state]]
-
-
-        # remove arcs from arcs_by_state_dict
-        for state in unreachable_states:
-             self.arcs_by_state_dict.pop(state, None)  #TODO add None for Yimas
-
-        for origin_state in self.arcs_by_state_dict.keys():  #TODO maybe we don't need this due to the nature of cliques
-            for state in unreachable_states:
-                self.arcs_by_state_dict[origin_state].pop(state, None)
-
-        #remove arcs for _arcs
-        self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in unreachable_states) and
-                                                        (arc.terminal_state not in unreachable_states))]
-
-        #remove states
-        self.states[:] = [state for state in self.states if state not in unreachable_states]
-        self.final_states[:] = [state for state in self.final_states if state not in unreachable_states]
-
+        self.arc_index = None
+        self._remove_dead_states(self.get_reachable_states(self.initial_state))
 
         if with_impasse_states:
-            #clear impasse states:
-            state_impasse_dict = {state: True for state in self.states}  # all states are impasse at first
-            for final_state in self.final_states:                         # except for the final states
-                state_impasse_dict[final_state] = False
-
-            while True:    # "do while" loop
-                change_in_dict = False
-                for arc in self._arcs:
-                    if not state_impasse_dict[arc.terminal_state] and state_impasse_dict[arc.origin_state]:
-                        state_impasse_dict[arc.origin_state] = False
-                        change_in_dict = True
-
-                if not change_in_dict:
-                    break
-
-            impasse_states = [state for state in state_impasse_dict if state_impasse_dict[state]]
-
-            # remove arcs from arcs_by_state_dict
-            for state in impasse_states:
-                 self.arcs_by_state_dict.pop(state, None)
-
-            for origin_state in self.arcs_by_state_dict.keys():
-                for state in impasse_states:
-                    self.arcs_by_state_dict[origin_state].pop(state, None)
-
-            #remove arcs for _arcs
-            self._arcs[:] = [arc for arc in self._arcs if ((arc.origin_state not in impasse_states) and
-                                                            (arc.terminal_state not in impasse_states))]
-
-            #remove states
-            self.states[:] = [state for state in self.states if state not in impasse_states]
-            self.final_states[:] = [state for state in self.final_states if state not in impasse_states]
+            origin_states_by_terminal_state = defaultdict(list)
+            for origin_state, arcs_by_terminal_state in self.arcs_by_state_dict.items():
+                for terminal_state in arcs_by_terminal_state:
+                    origin_states_by_terminal_state[terminal_state].append(origin_state)
+
+            co_reachable_states = set(self.final_states)
+            states_to_visit = deque(self.final_states)
+            while states_to_visit:
+                state = states_to_visit.popleft()
+                for origin_state in origin_states_by_terminal_state[state]:
+                    if origin_state not in co_reachable_states:
+                        co_reachable_states.add(origin_state)
+                        states_to_visit.append(origin_state)
+            self._remove_dead_states(co_reachable_states)
 
             #logger.debug("clear_dead_states: transducer after: %s", self)
 
+    def get_reachable_states(self, state):
+        """the set of states that can be reached from state by following arcs (state included), by one BFS"""
+        reachable_states = {state}
+        states_to_visit = deque([state])
+        while states_to_visit:
+            state = states_to_visit.popleft()
+            for terminal_state in self.arcs_by_state_dict.get(state, ()):
+                if terminal_state not in reachable_states:
+                    reachable_states.add(terminal_state)
+                    states_to_visit.append(terminal_state)
+        return reachable_states
+
+    def _remove_dead_states(self, live_states):
+        """removes the states that are not in live_states, and the arcs that leave or enter them"""
+        arcs_by_state_dict = dict()
+        for origin_state, arcs_by_terminal_state in self.arcs_by_state_dict.items():
+            if origin_state in live_states:
+                arcs_by_state_dict[origin_state] = {terminal_state: arcs
+                                                    for terminal_state, arcs in arcs_by_terminal_state.items()
+                                                    if terminal_state in live_states}
+        self.arcs_by_state_dict = arcs_by_state_dict
+
+        self._arcs[:] = [arc for arc in self._arcs if arc.origin_state in live_states and
+                                                       arc.terminal_state in live_states]
+        self.states[:] = [state for state in self.states if state in live_states]
+        self.final_states[:] = [state for state in self.final_states if state in live_states]
 
     def get_length_of_cost_vectors(self):
         return self.length_of_cost_vectors
@@ -168,13 +165,26 @@ class Transducer:
         """
         returns a set of strings
         """
+        strings_by_state = self.get_strings_by_state(self.initial_state)
+
+        strings = set()
+        for state in self.get_final_states():
+            strings.update(strings_by_state[state])
+
+        return strings
+
+    def get_strings_by_state(self, initial_state, is_arc_included=None):
+        """
+        returns a dictionary with the set of output strings of the paths from initial_state to each state,
+        following only the arcs for which is_arc_included (when given) is true
+        """
         strings_by_state = dict()
 
         for state in self.states:
             strings_by_state[state] = set()
-        strings_by_state[self.initial_state].add('')
+        strings_by_state[initial_state].add('')
 
-        active_states = set([self.initial_state])
+        active_states = set([initial_state])
 
         sets_on_arcs_flag = isinstance(self._arcs[0].output, set)
 
@@ -184,6 +194,8 @@ class Transducer:
                 arcs = self.get_arcs_by_origin_state(state)
                 state_strings = list(strings_by_state[state])
                 for arc in arcs:
+                    if is_arc_included is not None and not is_arc_included(arc):
+                        continue
                     next_pass_states.add(arc.terminal_state)
                     for string1 in state_strings:
                         if sets_on_arcs_flag:
@@ -204,11 +216,7 @@ class Transducer:
                                 strings_by_state[arc.terminal_state].add(string1 + string2)
             active_states = next_pass_states
 
-        strings = set()
-        for state in self.get_final_states():
-            strings.update(strings_by_state[state])
-
-        return strings
+        return strings_by_state
 
     def get_arcs_by_origin_state(self, origin_state):
         arcs = list()
@@ -304,6 +312,10 @@ class Transducer:
     def _binary_intersection(cls, transducer1, transducer2):
         """ Intersect two transducers
 
+        The product is built on the fly: only state pairs that are reachable from the pair of initial states
+        are expanded, and the arcs of transducer2 are looked up in its ArcIndex so that arc pairs with
+        incompatible labels are never unified.
+
         :param transducer1: A transducer
         :type transducer1: Transducer
         :param transducer2: A transducer
@@ -314,26 +326,44 @@ class Transducer:
         alphabet = list(set(transducer1.alphabet) | set(transducer2.alphabet))
         cost_vectors_length = transducer1.length_of_cost_vectors + transducer2.length_of_cost_vectors
         transducer = Transducer(alphabet, length_of_cost_vectors=cost_vectors_length)
-        transducer.initial_state = transducer1.initial_state & transducer2.initial_state
-
-        for state1, state2 in itertools.product(transducer1.states, transducer2.states):
-            transducer.states.append(state1 & state2)
-
-        for state1, state2 in itertools.product(transducer1.final_states, transducer2.final_states):
-            transducer.final_states.append(state1 & state2)
-
-        for arc1, arc2 in itertools.product(transducer1._arcs, transducer2._arcs):
-            intersected_arc = Arc.intersect(arc1, arc2)
-            if intersected_arc is not None:
-                transducer.add_arc(intersected_arc)
+        final_states1 = set(transducer1.final_states)
+        final_states2 = set(transducer2.final_states)
+
+        arc_index2 = transducer2.get_arc_index()
+        states_by_pair = dict()
+        pairs_to_expand = deque()
+
+        def get_state(state1, state2):
+            pair = (state1, state2)
+            if pair not in states_by_pair:
+                state = state1 & state2
+                states_by_pair[pair] = state
+                transducer.states.append(state)
+                if state1 in final_states1 and state2 in final_states2:
+                    transducer.final_states.append(state)
+                pairs_to_expand.append(pair)
+            return states_by_pair[pair]
+
+        transducer.initial_state = get_state(transducer1.initial_state, transducer2.initial_state)
+
+        while pairs_to_expand:
+            state1, state2 = pairs_to_expand.popleft()
+            origin_state = states_by_pair[(state1, state2)]
+            for arc1 in transducer1.get_arcs_by_origin_state(state1):
+                for arc2 in arc_index2.get_candidate_arcs(state2, arc1.input, arc1.output):
+                    unified_labels = Arc.unify(arc1, arc2)
+                    if unified_labels is not None:
+                        unified_input, unified_output = unified_labels
+                        terminal_state = get_state(arc1.terminal_state, arc2.terminal_state)
+                        transducer.add_arc(Arc(origin_state, unified_input, unified_output,
+                                               arc1.cost_vector * arc2.cost_vector, terminal_state))
 
         return transducer
 
     @classmethod
     def intersection(cls, *transducers):
-        intersected_transducer = functools.reduce(Transducer._binary_intersection, transducers)
-        intersected_transducer.clear_dead_states()
-        return intersected_transducer
+        # _binary_intersection only creates reachable states, so there are no dead states to clear here
+        return functools.reduce(Transducer._binary_intersection, transducers)
 
     def __str__(self):
         string_io = StringIO()
@@ -362,6 +392,10 @@ class Transducer:
     def get_info(self):
         return "the transducer has {} arcs and {} states".format(len(self._arcs), len(self.states))
 
+    def get_size(self):
+        """the number of states and arcs, the measure of memory the transducer caches are bounded by"""
+        return len(self.states) + len(self._arcs)
+
     def __eq__(self, other):
         def get_set_of_strings_from_list(list_):   #Work around for problem in PY3 concerning Unicode
             return set([str(item) for item in list_])
@@ -380,6 +414,76 @@ class Transducer:
         return result
 
 
+class ArcIndex:
+    """
+    The arcs of a transducer bucketed by origin state, and within a state by input label and by output label.
+    JOKER labels have buckets of their own, and an arc with a set of strings as output is bucketed under each
+    of the strings (Segment unification of a segment with a set is membership of its symbol in the set).
+    """
+    __slots__ = ["arcs_by_state", "arcs_by_input", "joker_input_arcs", "arcs_by_output", "joker_output_arcs",
+                 "set_output_arcs"]
+
+    def __init__(self, transducer):
+        self.arcs_by_state = dict()
+        self.arcs_by_input = dict()
+        self.joker_input_arcs = dict()
+        self.arcs_by_output = dict()
+        self.joker_output_arcs = dict()
+        self.set_output_arcs = dict()
+        for arc in transducer.get_arcs():
+            state = arc.origin_state
+            if state not in self.arcs_by_state:
+                for dict_ in (self.arcs_by_input, self.arcs_by_output):
+                    dict_[state] = defaultdict(list)
+                for dict_ in (self.arcs_by_state, self.joker_input_arcs, self.joker_output_arcs, self.set_output_arcs):
+                    dict_[state] = list()
+            self.arcs_by_state[state].append(arc)
+
+            if arc.input == JOKER_SEGMENT:
+                self.joker_input_arcs[state].append(arc)
+            else:
+                self.arcs_by_input[state][arc.input.get_symbol()].append(arc)
+
+            if isinstance(arc.output, set):
+                self.set_output_arcs[state].append(arc)
+                for string in arc.output:
+                    self.arcs_by_output[state][string].append(arc)
+            elif arc.output == JOKER_SEGMENT:
+                self.joker_output_arcs[state].append(arc)
+            else:
+                self.arcs_by_output[state][arc.output.get_symbol()].append(arc)
+
+    def get_arcs_by_input(self, state, input):
+        """arcs leaving state whose input label can unify with input"""
+        if state not in self.arcs_by_state:
+            return []
+        if input == JOKER_SEGMENT:
+            return self.arcs_by_state[state]
+        return self.arcs_by_input[state].get(input.get_symbol(), []) + self.joker_input_arcs[state]
+
+    def get_arcs_by_output(self, state, output):
+        """arcs leaving state whose output label can unify with output"""
+        if state not in self.arcs_by_state:
+            return []
+        if isinstance(output, set):
+            arcs = self.joker_output_arcs[state] + self.set_output_arcs[state]
+            for string in output:
+                arcs.extend(arc for arc in self.arcs_by_output[state].get(string, [])
+                            if not isinstance(arc.output, set))
+            return arcs
+        if output == JOKER_SEGMENT:
+            return self.arcs_by_state[state]
+        return self.arcs_by_output[state].get(output.get_symbol(), []) + self.joker_output_arcs[state]
+
+    def get_candidate_arcs(self, state, input, output):
+        """the smaller of the input and output buckets - a superset of the arcs that unify with (input, output)"""
+        arcs_by_input = self.get_arcs_by_input(state, input)
+        if len(arcs_by_input) <= 1:
+            return arcs_by_input
+        arcs_by_output = self.get_arcs_by_output(state, output)
+        return arcs_by_input if len(arcs_by_input) <= len(arcs_by_output) else arcs_by_output
+
+
 class State:
     __slots__ = ["label", "index", "hash"]
 
@@ -409,6 +513,10 @@ class State:
     def __hash__(self):
         return self.hash
 
+    def __reduce__(self):
+        # the hash is recomputed, a pickled one is of the hash seed of the pickling process
+        return State, (self.label, self.index)
+
     def __str__(self):
         return "({0},{1})".format(self.label, str(self.index))
 
@@ -428,14 +536,25 @@ class Arc:
         self.hash = hash((self.origin_state, self.input, self.terminal_state))
 
     def swap_weights(self, i, j):
-        self.cost_vector.swap_weights(i, j)
+        self.cost_vector = self.cost_vector.swap_weights(i, j)
 
-    @classmethod
-    def intersect(cls, arc1, arc2):
+    @staticmethod
+    def unify(arc1, arc2):
+        """returns the (input, output) labels of the intersection of two arcs, or None if they are incompatible"""
         unified_input = Segment.intersect(arc1.input, arc2.input)
+        if unified_input is None:
+            return None
         unified_output = Segment.intersect(arc1.output, arc2.output)
+        if unified_output is None:
+            return None
+        return unified_input, unified_output
+
+    @classmethod
+    def intersect(cls, arc1, arc2):
+        unified_labels = Arc.unify(arc1, arc2)
 
-        if unified_input is not None and unified_output is not None:
+        if unified_labels is not None:
+            unified_input, unified_output = unified_labels
             new_origin_state = arc1.origin_state & arc2.origin_state
             new_terminal_state = arc1.terminal_state & arc2.terminal_state
             cost_vector = arc1.cost_vector * arc2.cost_vector
@@ -455,6 +574,10 @@ class Arc:
     def __hash__(self):
         return self.hash
 
+    def __reduce__(self):
+        # the hash is recomputed, as in State.__reduce__
+        return Arc, (self.origin_state, self.input, self.output, self.cost_vector, self.terminal_state)
+
     def __str__(self):
         if isinstance(self.output, set):
             output = str(self.output)
@@ -469,34 +592,44 @@ class Arc:
 
 
 class CostVector:
+    """
+    an immutable vector of constraint violations, backed by a tuple.
+    a vector is more harmonic (greater) than another if it is lexicographically smaller, so tuple comparison
+    does the ordering. the infinite vector is a single instance which is less harmonic than any finite vector.
+    """
+    __slots__ = ["vector"]
+
     def __init__(self, vector):
-        self.vector = vector
-        self.hash = hash(str(self.vector))
+        self.vector = tuple(vector)
 
     def _verify_equal_length(self, other):
         if len(self.vector) != len(other.vector):
                 raise ValueError()
 
     def swap_weights(self, i, j):
-        self.vector[i], self.vector[j] = self.vector[j], self.vector[i]
-        self.hash = hash(str(self.vector))
+        """returns a new vector with the weights at i and j swapped"""
+        vector = list(self.vector)
+        vector[i], vector[j] = vector[j], vector[i]
+        return CostVector(vector)
 
     def __add__(self, other):
         """Vector pointwise addition - must have the same length"""
         self._verify_equal_length(other)
-        return CostVector([a+b for a, b in zip(self.vector, other.vector)])
+        return CostVector(map(add, self.vector, other.vector))
 
     def __sub__(self, other):
         """Vector pointwise subtraction - must have the same length"""
         self._verify_equal_length(other)
-        return CostVector([a-b for a, b in zip(self.vector, other.vector)])
+        return CostVector(map(sub, self.vector, other.vector))
 
     def __mul__(self, other):
         """Vector concatenation"""
         return CostVector(self.vector + other.vector)
 
     def __str__(self):
-        return str(self.vector)
+        if self is CostVector.INF:
+            return str(float("inf"))
+        return str(list(self.vector))
 
     def __repr__(self):
         return self.__str__()
@@ -511,35 +644,80 @@ class CostVector:
         return self.vector != other.vector
 
     def __hash__(self):
-        return self.hash
+        return hash(self.vector)
 
     def __lt__(self, other):
-        return not __gt__ and not self == other
+        return self.vector > other.vector
 
     def __gt__(self, other):
-        if self == CostVector.get_inf_vector():
-            return False
-        if other == CostVector.get_inf_vector():
-            return True
-        else:
-            self._verify_equal_length(other)
-            difference = self - other
-            for i in difference.vector:
-                if i == 0:
-                    continue
-                if i < 0:
-                    return True
-                else:
-                    return False
+        return self.vector < other.vector
+
+    def __reduce__(self):
+        if self is CostVector.INF:
+            return CostVector.get_inf_vector, ()
+        return CostVector, (self.vector,)
 
     @staticmethod
     def get_inf_vector():
-        return CostVector(float("inf"))  #TODO create static variable
+        return CostVector.INF
 
     @staticmethod
     def get_empty_vector():
-        return CostVector(list())
+        return CostVector(())
 
     @staticmethod
     def get_vector(size, value):
-        return CostVector([value] * size)
+        return CostVector((value,) * size)
+
+
+CostVector.INF = CostVector((float("inf"),))
+
+
+class CostPacker:
+    """
+    packs cost vectors into (negative) ints, mixed radix with the highest ranked constraint as the most
+    significant digit. as long as no component of a sum of vectors reaches the base, packing commutes with
+    addition, and the packed values keep the CostVector semantics: greater is more harmonic, max is the most
+    harmonic, and the infinite vector packs to -inf.
+    """
+    __slots__ = ["length_of_cost_vectors", "base", "weights", "packed_by_cost_vector"]
+
+    INF = float("-inf")
+
+    def __init__(self, length_of_cost_vectors, base):
+        self.length_of_cost_vectors = length_of_cost_vectors
+        self.base = base
+        self.weights = [-base ** i for i in reversed(range(length_of_cost_vectors))]
+        self.packed_by_cost_vector = dict()
+
+    @classmethod
+    def get_packer(cls, length_of_cost_vectors, max_component_sum):
+        """a packer for vectors (and sums of vectors) whose components are at most max_component_sum,
+        or None if the packed values would not fit in a machine word - use CostVectors then"""
+        base = max_component_sum + 1
+        if base ** length_of_cost_vectors > sys.maxsize:
+            return None
+        return cls(length_of_cost_vectors, base)
+
+    def pack(self, cost_vector):
+        packed = self.packed_by_cost_vector.get(cost_vector)
+        if packed is None:
+            if cost_vector is CostVector.INF:
+                packed = CostPacker.INF
+            else:
+                packed = sum(map(mul, cost_vector.vector, self.weights))
+            self.packed_by_cost_vector[cost_vector] = packed
+        return packed
+
+    def pack_arc_cost(self, arc):
+        return self.pack(arc.cost_vector)
+
+    def unpack(self, packed):
+        if packed == CostPacker.INF:
+            return CostVector.get_inf_vector()
+        vector = list()
+        packed = -packed
+        for _ in range(self.length_of_cost_vectors):
+            packed, component = divmod(packed, self.base)
+            vector.append(component)
+        return CostVector(reversed(vector))
@@ -0,0 +1,70 @@
+"""
+an optional on-disk cache of grammar transducers (the results of make_optimal_paths), shared by all the processes
+that run the same simulation, e.g. a batch of seeds.
+
+files are content addressed: the name of a file is a hash of everything the transducer is built from - the feature
+table, the configurations that change the constraint transducers, and the constraint set.
+the cache is enabled by setting the TRANSDUCERS_DISK_CACHE_DIRECTORY configuration to a directory path.
+loading is eager: a cached transducer is read and unpickled whole.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+from tempfile import NamedTemporaryFile
+
+from utils import get_configuration, get_feature_table
+
+logger = logging.getLogger(__name__)
+
+DISK_CACHE_FORMAT_VERSION = 1  # bump when the pickled Transducer layout changes, old files are then ignored
+
+transducer_building_configurations = ["ALLOW_CANDIDATES_WITH_CHANGED_SEGMENTS"]
+
+
+def get_disk_cache_directory():
+    """the cache directory, or None if the cache is disabled"""
+    return get_configuration("TRANSDUCERS_DISK_CACHE_DIRECTORY")
+
+
+def get_disk_cache_key(constraint_set_key):
+    feature_table = get_feature_table()
+    features = [feature_table.feature_order_dict[i] for i in sorted(feature_table.feature_order_dict)]
+    key_json = json.dumps([DISK_CACHE_FORMAT_VERSION,
+                           features, feature_table.feature_types_dict, feature_table.feature_table_dict,
+                           [get_configuration(configuration) for configuration in transducer_building_configurations],
+                           constraint_set_key], sort_keys=True)
+    return hashlib.sha256(key_json.encode("utf-8")).hexdigest()
+
+
+def _get_transducer_file_path(directory, constraint_set_key):
+    return os.path.join(directory, get_disk_cache_key(constraint_set_key) + ".pkl")
+
+
+def load_transducer(constraint_set_key):
+    """the cached transducer of the constraint set, or None"""
+    directory = get_disk_cache_directory()
+    if not directory:
+        return None
+    file_path = _get_transducer_file_path(directory, constraint_set_key)
+    try:
+        with open(file_path, "rb") as file:
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except (ValueError, EOFError, pickle.UnpicklingError) as ex:
+        logger.warning("ignoring unreadable cached transducer {}: {}".format(file_path, ex))
+        return None
+
+
+def store_transducer(constraint_set_key, transducer):
+    """writes to a temporary file which is then renamed, so processes that share the directory
+    never read a partially written transducer"""
+    directory = get_disk_cache_directory()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    with NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as file:
+        pickle.dump(transducer, file, -1)
+    os.replace(file.name, _get_transducer_file_path(directory, constraint_set_key))
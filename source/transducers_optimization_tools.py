@@ -1,11 +1,13 @@
 import logging
 import itertools
+from heapq import heappush, heappop
 from functools import reduce
-import pickle
 
-from transducer import Transducer, CostVector, Arc
+from operator import attrgetter, neg
+
+from transducer import Transducer, CostVector, CostPacker, Arc
+from compact_transducer import CompactTransducer
 from word import Word
-import random
 from debug_tools import timeit, write_to_dot
 
 
@@ -16,30 +18,126 @@ class TransducerOptimizationError(Exception):
 
 
 def get_cheapest_state(list_of_states, cost_by_state_dict):
-
-    most_harmonic_state = random.choice(list_of_states)
-    try:   #TODO for debug prints
-        most_harmonic_cost_vector = cost_by_state_dict[most_harmonic_state]
-    except KeyError as ex:
-        #print(cost_by_state_dict)
-        raise ex
+    """the first of the states with the most harmonic cost"""
+    most_harmonic_state = list_of_states[0]
+    most_harmonic_cost_vector = cost_by_state_dict[most_harmonic_state]
     for state in list_of_states:
         if cost_by_state_dict[state] > most_harmonic_cost_vector:
             most_harmonic_cost_vector = cost_by_state_dict[state]
             most_harmonic_state = state
     return most_harmonic_state
 
+
+def get_cost_packer(transducer, max_number_of_arcs):
+    """a CostPacker for the sums of up to max_number_of_arcs arc costs of the transducer (a Transducer or a
+    CompactTransducer), or None"""
+    if isinstance(transducer, CompactTransducer):
+        max_component = max(transducer.cost_pool, default=0)
+    else:
+        max_component = max((max(arc.cost_vector.vector, default=0) for arc in transducer.get_arcs()), default=0)
+    return CostPacker.get_packer(transducer.get_length_of_cost_vectors(), max_number_of_arcs * max_component)
+
+
+def _get_optimal_costs(transducer, initial_state, states, cost_packer=None):
+    """ the costs of the most harmonic paths from initial_state to each of the states (all reachable from it)
+
+    Dijkstra's algorithm with a heap keyed on the cost tuples: tuples compare lexicographically, so the smallest
+    key is the most harmonic cost (see CostVector.__gt__). ties are broken by insertion order.
+    with a cost_packer the costs are packed ints, and the key is their negation.
+    the paths of the search have at most len(states) arcs, the cost_packer must fit their sums.
+    """
+    states = set(states)
+    if cost_packer:
+        get_arc_cost, get_key = cost_packer.pack_arc_cost, neg
+        costs = {state: CostPacker.INF for state in states}
+        costs[initial_state] = 0
+    else:
+        get_arc_cost, get_key = attrgetter("cost_vector"), attrgetter("vector")
+        costs = {state: CostVector.get_inf_vector() for state in states}
+        costs[initial_state] = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
+    settled_states = set()
+    insertion_counter = itertools.count()
+    heap = [(get_key(costs[initial_state]), next(insertion_counter), initial_state)]
+
+    while heap:
+        _, _, cheapest_state = heappop(heap)
+        if cheapest_state in settled_states:
+            continue
+        settled_states.add(cheapest_state)
+        cheapest_cost = costs[cheapest_state]
+        for state, arcs in transducer.arcs_by_state_dict.get(cheapest_state, {}).items():
+            if state in settled_states or state not in states:
+                continue
+            for arc in arcs:
+                cost = cheapest_cost + get_arc_cost(arc)
+                if cost > costs[state]:
+                    costs[state] = cost
+                    heappush(heap, (get_key(cost), next(insertion_counter), state))
+    return costs
+
+
+def _get_compact_arc_costs(transducer, cost_packer=None):
+    """the costs of the arcs of a CompactTransducer by arc index, packed with the cost_packer or as CostVectors.
+    the arcs with the same pooled cost share its cost"""
+    length_of_cost_vectors = transducer.get_length_of_cost_vectors()
+    cost_by_offset = dict()
+    arc_costs = list()
+    for cost_offset in transducer.arc_cost_offsets:
+        cost = cost_by_offset.get(cost_offset)
+        if cost is None:
+            cost = CostVector(transducer.cost_pool[cost_offset:cost_offset + length_of_cost_vectors])
+            if cost_packer:
+                cost = cost_packer.pack(cost)
+            cost_by_offset[cost_offset] = cost
+        arc_costs.append(cost)
+    return arc_costs
+
+
+def _get_infinite_cost(cost_packer=None):
+    return CostPacker.INF if cost_packer else CostVector.get_inf_vector()
+
+
+def _get_compact_optimal_costs(transducer, initial_state, arc_costs, cost_packer=None):
+    """ the costs of the most harmonic paths from initial_state to the states of a CompactTransducer, by state id.
+    the same search as _get_optimal_costs, over the arc arrays. arc_costs are the costs of the arcs (see
+    _get_compact_arc_costs), and the states that are not reachable from initial_state keep the infinite cost.
+    """
+    if cost_packer:
+        get_key = neg
+        initial_cost = 0
+    else:
+        get_key = attrgetter("vector")
+        initial_cost = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
+    costs = [_get_infinite_cost(cost_packer)] * transducer.number_of_states
+    costs[initial_state] = initial_cost
+    arc_terminals = transducer.arc_terminals
+    settled_states = set()
+    insertion_counter = itertools.count()
+    heap = [(get_key(initial_cost), next(insertion_counter), initial_state)]
+
+    while heap:
+        _, _, cheapest_state = heappop(heap)
+        if cheapest_state in settled_states:
+            continue
+        settled_states.add(cheapest_state)
+        cheapest_cost = costs[cheapest_state]
+        for arc_index in transducer.get_arc_range(cheapest_state):
+            state = arc_terminals[arc_index]
+            if state in settled_states:
+                continue
+            cost = cheapest_cost + arc_costs[arc_index]
+            if cost > costs[state]:
+                costs[state] = cost
+                heappush(heap, (get_key(cost), next(insertion_counter), state))
+    return costs
+
+
 def remove_suboptimal_paths(transducer):
-    active_states = set(transducer.states)
-    costs = {state: CostVector.get_inf_vector() for state in active_states}
-    costs[transducer.initial_state] = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
-
-    while active_states:
-        cheapest_state = get_cheapest_state(list(active_states), costs)
-        active_states.remove(cheapest_state)
-        for state in active_states:
-            for arc in transducer.get_arcs_by_origin_and_terminal_state(cheapest_state, state):
-                costs[state] = max(costs[state], costs[cheapest_state] + arc.cost_vector)
+    if isinstance(transducer, CompactTransducer):
+        return _remove_compact_suboptimal_paths(transducer)
+    cost_packer = get_cost_packer(transducer, len(transducer.states))
+    get_arc_cost = cost_packer.pack_arc_cost if cost_packer else attrgetter("cost_vector")
+    costs = _get_optimal_costs(transducer, transducer.initial_state, transducer.states, cost_packer)
     try:    #TODO for debug prints
         most_harmonic_final = get_cheapest_state(transducer.get_final_states(), costs)
     except KeyError as ex:
@@ -50,7 +148,7 @@ def remove_suboptimal_paths(transducer):
 
     new_arcs = []
     for arc in transducer.get_arcs():
-        if costs[arc.origin_state] + arc.cost_vector == costs[arc.terminal_state]:
+        if costs[arc.origin_state] + get_arc_cost(arc) == costs[arc.terminal_state]:
             new_arcs.append(arc)
     transducer.set_arcs(new_arcs)
 
@@ -58,61 +156,128 @@ def remove_suboptimal_paths(transducer):
     return transducer
 
 
-def _get_path_cost(transducer):
-    #logger.debug("_get_path_cost: transducer input: %s", transducer)
-    current_state = transducer.get_a_final_state()
-    path_cost = CostVector.get_vector(transducer.get_length_of_cost_vectors(), 0)
-    initial_state = transducer.initial_state
-    while current_state != initial_state:
-        arcs_to_current_state = transducer.get_arcs_by_terminal_state(current_state)
-        if arcs_to_current_state:
-            arc = arcs_to_current_state[0]
-            if arc.origin_state == current_state:
-                raise TransducerOptimizationError('Cyclic Transducer')
-        else:
-            raise TransducerOptimizationError("No arcs leading to the current state. It is a dead state.")
-        current_state = arc.origin_state
-        path_cost += arc.cost_vector
-
-    return path_cost
+def _remove_compact_suboptimal_paths(transducer):
+    cost_packer = get_cost_packer(transducer, transducer.number_of_states)
+    arc_costs = _get_compact_arc_costs(transducer, cost_packer)
+    costs = _get_compact_optimal_costs(transducer, transducer.initial_state, arc_costs, cost_packer)
+    transducer.final_states = {get_cheapest_state(sorted(transducer.final_states), costs)}
+    arc_terminals = transducer.arc_terminals
+    transducer.keep_arcs(lambda state, arc_index:
+                         costs[state] + arc_costs[arc_index] == costs[arc_terminals[arc_index]])
+    return transducer
 
 
 def make_optimal_paths(transducer_input):
-    transducer = pickle.loads(pickle.dumps(transducer_input, -1))
+    """ Replaces the arcs of the transducer with one arc for every segment and pair of states (state1, state2)
+    that are connected by a path consuming the segment. the arc cost is the cost of the most harmonic such paths
+    and its output is the set of their outputs.
+
+    The paths are those of the intersection of the transducer with the transducer of the one-segment word.
+    for each state1 a single optimal-costs pass over the intersection (without copying it) yields the arcs to
+    all the states2 at once. the passes run on packed costs when they fit a machine word.
+    a CompactTransducer is searched on its arc arrays (see _make_compact_optimal_paths). the result is a Transducer.
+    """
+    if isinstance(transducer_input, CompactTransducer):
+        return _make_compact_optimal_paths(transducer_input)
+
+    transducer = Transducer(transducer_input.get_alphabet(), name=transducer_input.name,
+                            length_of_cost_vectors=transducer_input.get_length_of_cost_vectors())
+    transducer.states = list(transducer_input.get_states())
+    transducer.initial_state = transducer_input.initial_state
+    transducer.set_final_states(list(transducer_input.get_final_states()))
+
     alphabet = transducer.get_alphabet()
+    states = transducer.get_states()
+    arc_index = transducer_input.get_arc_index()  # built once, used by all the intersections below
     new_arcs = list()
     for segment in alphabet:
+        if not any(arc_index.get_arcs_by_input(state, segment) for state in states):
+            continue  # no arc can consume the segment, so there are no paths to optimize
         word = Word(segment.get_symbol())
         word_transducer = word.get_transducer()
         #print(word_transducer.dot_representation())
-        intersected_machine = Transducer.intersection(word_transducer, transducer)
-        states = transducer.get_states()
-        for state1, state2 in itertools.product(states, states):
+        intersected_machine = Transducer.intersection(word_transducer, transducer_input)
+        intersected_machine_states = set(intersected_machine.get_states())
+        final_state_by_state = {state: word_transducer.get_a_final_state() & state for state in states}
+        cost_packer = get_cost_packer(intersected_machine, len(intersected_machine_states))
+        if cost_packer:
+            get_arc_cost, get_cost_vector = cost_packer.pack_arc_cost, cost_packer.unpack
+        else:
+            get_arc_cost, get_cost_vector = attrgetter("cost_vector"), lambda cost: cost
+        for state1 in states:
             initial_state = word_transducer.initial_state & state1
-            final_state = word_transducer.get_a_final_state() & state2
-            temp_transducer = pickle.loads(pickle.dumps(intersected_machine, -1))
-            temp_transducer.initial_state = initial_state
-            temp_transducer.set_final_state(final_state)
-            temp_transducer.clear_dead_states()
-            if final_state in temp_transducer.get_final_states():  # otherwise no path.
-                try:
-                    temp_transducer = remove_suboptimal_paths(temp_transducer)
-                    range = temp_transducer.get_range()
-                    arc = Arc(state1, segment, range, _get_path_cost(temp_transducer), state2)
+            if initial_state not in intersected_machine_states:
+                continue
+            reachable_states = intersected_machine.get_reachable_states(initial_state)
+            costs = _get_optimal_costs(intersected_machine, initial_state, reachable_states, cost_packer)
+            strings_by_state = intersected_machine.get_strings_by_state(
+                initial_state, lambda arc: costs[arc.origin_state] + get_arc_cost(arc) == costs[arc.terminal_state])
+            for state2 in states:
+                final_state = final_state_by_state[state2]
+                if final_state in reachable_states:  # otherwise no path.
+                    arc = Arc(state1, segment, strings_by_state[final_state],
+                              get_cost_vector(costs[final_state]), state2)
                     new_arcs.append(arc)
-                except KeyError:
-                    pass
-                #print("****")
-                #print(temp_transducer.dot_representation())
 
     transducer.set_arcs(new_arcs)
     return transducer
 
 
-def _best_arcs(arcs_from_current_index, state_costs):
+def _make_compact_optimal_paths(transducer_input):
+    """make_optimal_paths of a CompactTransducer: the intersections with the one-segment word transducers are
+    compact (in the family of transducer_input), and their searches run on the arc arrays. only the arcs of the
+    result are objects, between the labeled states of transducer_input"""
+    transducer = Transducer(transducer_input.get_alphabet(), name=transducer_input.name,
+                            length_of_cost_vectors=transducer_input.get_length_of_cost_vectors())
+    states = transducer_input.get_labeled_states()
+    transducer.states = states
+    transducer.initial_state = states[transducer_input.initial_state]
+    transducer.set_final_states([states[state] for state in sorted(transducer_input.final_states)])
+
+    symbol_table = transducer_input.symbol_table
+    input_symbol_ids = set(transducer_input.arc_inputs)
+    new_arcs = list()
+    for segment in transducer.get_alphabet():
+        if symbol_table.get_symbol_id(segment) not in input_symbol_ids and \
+                symbol_table.joker_id not in input_symbol_ids:
+            continue  # no arc can consume the segment, so there are no paths to optimize
+        word_transducer = CompactTransducer.from_transducer(Word(segment.get_symbol()).get_transducer(), symbol_table)
+        intersected_machine = CompactTransducer.intersection(word_transducer, transducer_input)
+        word_final_state = next(iter(word_transducer.final_states))
+        initial_state_by_state, final_state_by_state = dict(), dict()
+        for state in range(intersected_machine.number_of_states):
+            word_state, input_state = intersected_machine.state_pairs[2 * state: 2 * state + 2]
+            if word_state == word_transducer.initial_state:
+                initial_state_by_state[input_state] = state
+            if word_state == word_final_state:
+                final_state_by_state[input_state] = state
+        cost_packer = get_cost_packer(intersected_machine, intersected_machine.number_of_states)
+        get_cost_vector = cost_packer.unpack if cost_packer else lambda cost: cost
+        infinite_cost = _get_infinite_cost(cost_packer)
+        arc_costs = _get_compact_arc_costs(intersected_machine, cost_packer)
+        arc_terminals = intersected_machine.arc_terminals
+        for state1 in range(transducer_input.number_of_states):
+            initial_state = initial_state_by_state.get(state1)
+            if initial_state is None:
+                continue
+            costs = _get_compact_optimal_costs(intersected_machine, initial_state, arc_costs, cost_packer)
+            strings_by_state = intersected_machine.get_strings_by_state(
+                initial_state,
+                lambda state, arc_index: costs[state] + arc_costs[arc_index] == costs[arc_terminals[arc_index]])
+            for state2 in range(transducer_input.number_of_states):
+                final_state = final_state_by_state.get(state2)
+                if final_state is not None and costs[final_state] != infinite_cost:  # otherwise no path.
+                    new_arcs.append(Arc(states[state1], segment, strings_by_state[final_state],
+                                        get_cost_vector(costs[final_state]), states[state2]))
+
+    transducer.set_arcs(new_arcs)
+    return transducer
+
+
+def _best_arcs(arcs_from_current_index, state_costs, get_arc_cost=attrgetter("cost_vector")):
     best_arcs_by_state = {}
     for arc in arcs_from_current_index:
-        current_cost = state_costs[arc.origin_state] + arc.cost_vector
+        current_cost = state_costs[arc.origin_state] + get_arc_cost(arc)
         if arc.terminal_state in best_arcs_by_state.keys():
             terminus_cost = state_costs[arc.terminal_state]
             if current_cost > terminus_cost:
@@ -125,7 +290,15 @@ def _best_arcs(arcs_from_current_index, state_costs):
             state_costs[arc.terminal_state] = current_cost
     return reduce(lambda a, b: a+b, best_arcs_by_state.values())
 
-def optimize_transducer_grammar_for_word(word, eval):
+def optimize_transducer_grammar_for_word(word, eval, cost_packer=None):
+    """ keeps the most harmonic paths of eval, the intersection of the word transducer and the grammar transducer.
+    each path has an arc per segment of the word, so an optional cost_packer that fits the sums of len(word)
+    grammar arc costs lets the pass run on packed costs. it is ignored if eval has arcs that do not advance
+    in the word. a CompactTransducer is optimized on its arc arrays, into a CompactTransducer.
+    """
+    if isinstance(eval, CompactTransducer):
+        return _optimize_compact_transducer_grammar_for_word(word, eval, cost_packer)
+
     states_by_index = {}
     for state in eval.states:
         if state.index in states_by_index.keys():
@@ -142,17 +315,25 @@ def optimize_transducer_grammar_for_word(word, eval):
 
     new_transducer = Transducer(eval.get_alphabet())
 
+    if cost_packer and any(arc.terminal_state.index != arc.origin_state.index + 1 for arc in eval._arcs):
+        cost_packer = None
+
     state_costs = {}
     new_transducer.add_state(eval.initial_state)
     new_transducer.initial_state = eval.initial_state
-    state_costs[eval.initial_state] = CostVector.get_vector(eval.get_length_of_cost_vectors(), 0)
+    if cost_packer:
+        get_arc_cost = cost_packer.pack_arc_cost
+        state_costs[eval.initial_state] = 0
+    else:
+        get_arc_cost = attrgetter("cost_vector")
+        state_costs[eval.initial_state] = CostVector.get_vector(eval.get_length_of_cost_vectors(), 0)
 
     for index in range(len(word.get_segments())):
-        new_arcs = _best_arcs(arcs_by_index[index], state_costs)
+        new_arcs = _best_arcs(arcs_by_index[index], state_costs, get_arc_cost)
         for arc in new_arcs:
             new_transducer.add_arc(arc)
             new_transducer.add_state(arc.terminal_state)
-            state_costs[arc.terminal_state] = state_costs[arc.origin_state] + arc.cost_vector
+            state_costs[arc.terminal_state] = state_costs[arc.origin_state] + get_arc_cost(arc)
 
     new_final_states = [eval.final_states[0]]
     for state in eval.final_states[1:]:
@@ -171,3 +352,49 @@ def optimize_transducer_grammar_for_word(word, eval):
     return new_transducer
 
 
+def _optimize_compact_transducer_grammar_for_word(word, eval, cost_packer=None):
+    """optimize_transducer_grammar_for_word of a CompactTransducer: a copy of eval with the arcs of the most
+    harmonic paths (the same choice of arcs, by their arc indices) and the most harmonic final states"""
+    state_indices = eval.state_indices
+    arcs_by_index = dict()
+    for state in range(eval.number_of_states):
+        arcs_by_index.setdefault(state_indices[state], []).extend((state, arc_index)
+                                                                   for arc_index in eval.get_arc_range(state))
+
+    if cost_packer and any(state_indices[eval.arc_terminals[arc_index]] != state_indices[state] + 1
+                           for arcs in arcs_by_index.values() for state, arc_index in arcs):
+        cost_packer = None
+    arc_costs = _get_compact_arc_costs(eval, cost_packer)
+
+    state_costs = [None] * eval.number_of_states
+    if cost_packer:
+        state_costs[eval.initial_state] = 0
+    else:
+        state_costs[eval.initial_state] = CostVector.get_vector(eval.get_length_of_cost_vectors(), 0)
+
+    is_arc_kept = bytearray(eval.get_number_of_arcs())
+    for index in range(len(word.get_segments())):
+        best_arcs_by_state = dict()
+        for state, arc_index in arcs_by_index[index]:
+            current_cost = state_costs[state] + arc_costs[arc_index]
+            terminal_state = eval.arc_terminals[arc_index]
+            if terminal_state in best_arcs_by_state:
+                terminus_cost = state_costs[terminal_state]
+                if current_cost > terminus_cost:
+                    best_arcs_by_state[terminal_state] = [arc_index]
+                    state_costs[terminal_state] = current_cost
+                elif current_cost == terminus_cost:
+                    best_arcs_by_state[terminal_state].append(arc_index)
+            else:  # arc.terminus is newly introduced
+                best_arcs_by_state[terminal_state] = [arc_index]
+                state_costs[terminal_state] = current_cost
+        for arc_indices in best_arcs_by_state.values():
+            for arc_index in arc_indices:
+                is_arc_kept[arc_index] = 1
+
+    final_states = sorted(eval.final_states)
+    final_cost = max(state_costs[state] for state in final_states)
+    new_transducer = eval.get_copy()
+    new_transducer.final_states = {state for state in final_states if state_costs[state] == final_cost}
+    new_transducer.keep_arcs(lambda state, arc_index: is_arc_kept[arc_index])
+    return new_transducer
@@ -4,8 +4,9 @@ from segment import Segment, NULL_SEGMENT, JOKER_SEGMENT
 from transducer import Transducer, State, Arc, CostVector
 from utils import get_feature_table
 from debug_tools import write_to_dot as dot
+from bounded_cache import BoundedCache
 
-word_transducers = dict()
+word_transducers = BoundedCache("word transducers", "WORD_TRANSDUCERS_CACHE_SIZE")
 
 
 class Word:
@@ -23,12 +24,11 @@ class Word:
 
     def get_transducer(self):
         word_key = str(self)
-        if word_key in word_transducers:
-            return word_transducers[word_key]
-        else:
+        transducer = word_transducers.get(word_key)
+        if transducer is None:
             transducer = self._make_transducer()
             word_transducers[word_key] = transducer
-            return transducer
+        return transducer
 
     def _make_transducer(self):
         segments = self.feature_table.get_segments()
@@ -54,8 +54,7 @@ class Word:
 
     @staticmethod
     def clear_caching():
-        global word_transducers
-        word_transducers = dict()
+        word_transducers.clear()
 
     def __str__(self):
         return self.word_string